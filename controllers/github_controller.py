@@ -1,16 +1,25 @@
 from fastapi import HTTPException
-from utils.github_api import GitHubAPI
+from utils.github_api import (
+    get_github_api,
+    prune_shared_cache,
+    GitHubAuthError,
+    GitHubRateLimitError,
+    GitHubNotFoundError,
+    GitHubPermissionError
+)
 from utils.r2_storage import R2Storage
-import io
+from utils.zip_stream import ZipStream
+from utils.download_cache import DownloadCache
 from typing import Optional, Dict, Tuple, Union
+import asyncio
+import functools
+import hashlib
 import time
 import os
 import logging
-import hashlib
 from datetime import datetime, timedelta
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize R2 storage
@@ -18,135 +27,242 @@ r2_storage = R2Storage()
 
 # Cache of recent downloads to avoid regenerating the same ZIP file 
 # if requested multiple times in quick succession
-_download_cache = {}
-_cache_ttl = int(os.getenv("ZIP_CACHE_TTL_SECONDS", "300"))  # Default 5 minutes for ZIP file cache
+download_cache = DownloadCache()
 
 # Get link expiration time from environment
 link_expiration_hours = int(os.getenv("DOWNLOAD_LINK_EXPIRATION_HOURS", "24"))
 
+# Default 5 minutes for ZIP file cache, never longer than a download link lives
+_cache_ttl = min(int(os.getenv("ZIP_CACHE_TTL_SECONDS", "300")), link_expiration_hours * 3600)
+
+# Serverless workers don't run the background cleanup, so prune on each request
+_prune_on_request = bool(os.getenv("VERCEL", ""))
+
+class InvalidFolderPathError(ValueError):
+    """The requested folder path points outside the repository"""
+
+# HTTP status codes for GitHub API errors, anything else is a server error
+STATUS = {
+    InvalidFolderPathError: 400,
+    GitHubAuthError: 401,
+    GitHubRateLimitError: 429,
+    GitHubNotFoundError: 404,
+    GitHubPermissionError: 403,
+}
+
+# Send whole-repository downloads of public repositories straight to GitHub's
+# own archive instead of rebuilding it here. Off by default: GitHub's archive
+# puts every file under a "<repo>-<sha>/" directory and is always deflated
+zipball_redirect = os.getenv("GITHUB_ZIPBALL_REDIRECT", "false").lower() == "true"
+
+# Refresh cached links this long before they expire so clients never get a dead URL
+link_refresh_buffer_seconds = min(3600, link_expiration_hours * 3600 // 2)
+
+# Downloads currently being built, keyed like the download cache
+_inflight: Dict[str, asyncio.Future] = {}
+
 async def download_folder_as_zip(
     owner: str, 
     repo: str, 
     folder_path: str, 
-    token: Optional[str] = None
-) -> Tuple[Union[Dict, io.BytesIO], str]:
+    token: Optional[str] = None,
+    compress: Optional[bool] = None
+) -> Tuple[Union[Dict, ZipStream, str], str]:
     """
     Controller function to handle downloading a folder as a ZIP file and uploading to R2
     
     Returns:
         Tuple containing either:
         - (Dict with file info including download_url, filename string) if R2 upload succeeds
-        - (BytesIO containing the ZIP data, filename string) if R2 upload fails
+        - (ZipStream yielding the ZIP data, filename string) if R2 upload fails
+        - (GitHub archive URL string, filename string) for a whole public repository
     """
     try:
         # Create a cache key for this specific request
-        folder_path_normalized = folder_path.strip('/')
-        cache_key = f"{owner}:{repo}:{folder_path_normalized}:{token or 'default'}"
-        cache_hash = hashlib.md5(cache_key.encode()).hexdigest()
+        folder_path_normalized, folder_name = _folder_basename(folder_path, repo)
+        
+        # Leaving compression unset only matters for whole repositories, which may be
+        # relayed as GitHub's zipball; folders are stored uncompressed either way
+        if compress is None and folder_path_normalized:
+            compress = False
+        cache_key = f"{owner}:{repo}:{folder_path_normalized}:{token or 'default'}:{_compress_key(compress)}"
+        
+        if _prune_on_request:
+            prune_shared_cache()
         
         # Check if we have a recent cached result
         current_time = time.time()
-        if cache_hash in _download_cache:
-            cache_entry = _download_cache[cache_hash]
-            if current_time - cache_entry['timestamp'] < _cache_ttl:
-                logger.info(f"Using cached result for {owner}/{repo}/{folder_path_normalized}")
-                
-                # Check if the cached URL has expired
-                if isinstance(cache_entry['result'], dict) and 'data' in cache_entry['result']:
-                    data = cache_entry['result']['data']
-                    if 'expires_at' in data and data['expires_at']:
-                        expires_at = datetime.fromisoformat(data['expires_at'])
-                        
-                        # If link is expired, regenerate it
-                        if datetime.now() > expires_at:
-                            if r2_storage.check_file_exists(data.get('r2_key')):
-                                # Regenerate presigned URL if file still exists
-                                new_url = r2_storage.generate_presigned_url(data.get('r2_key'))
-                                if new_url:
-                                    # Update expiration
-                                    new_expires = datetime.now() + timedelta(hours=link_expiration_hours)
-                                    data['download_url'] = new_url
-                                    data['expires_at'] = new_expires.isoformat()
-                                    logger.info(f"Regenerated expired link for {data.get('r2_key')}")
-                
-                return cache_entry['result'], cache_entry['filename']
-            else:
-                # Remove expired entry
-                del _download_cache[cache_hash]
-        
-        # Initialize GitHub API with optional token
-        github_api = GitHubAPI(token)
+        cache_entry = await download_cache.get(cache_key)
+        if cache_entry:
+            logger.info(f"Using cached result for {owner}/{repo}/{folder_path_normalized}")
+            result = cache_entry['result']
+            data = result['data']
+            
+            # Refresh the link if it has expired or is about to
+            expires_at = datetime.fromisoformat(data['expires_at'])
+            if datetime.now() > expires_at - timedelta(seconds=link_refresh_buffer_seconds):
+                # Presigning is local and doesn't check the object exists; files are kept
+                # for days while cache entries last minutes, so a missing file is rare
+                # and surfaces as a 404 from R2 instead of costing a HEAD on every refresh
+                new_url = r2_storage.generate_presigned_url(data['r2_key'])
+                if new_url:
+                    # Update expiration and keep the entry for the rest of its lifetime
+                    new_expires = datetime.now() + timedelta(hours=link_expiration_hours)
+                    data['download_url'] = new_url
+                    data['expires_at'] = new_expires.isoformat()
+                    remaining_ttl = int(_cache_ttl - (current_time - cache_entry['timestamp']))
+                    await download_cache.set(cache_key, cache_entry, remaining_ttl)
+                    logger.info(f"Regenerated expiring link for {data['r2_key']}")
+            
+            return result, data['filename']
         
-        # Create ZIP file from the specified folder
-        zip_buffer = await github_api.create_zip_from_folder(owner, repo, folder_path)
+        # Coalesce identical concurrent requests so the archive is only built once
+        task = _inflight.get(cache_key)
+        is_leader = task is None
+        if is_leader:
+            task = asyncio.ensure_future(
+                _create_download(owner, repo, folder_path, folder_path_normalized, folder_name, token, compress, cache_key)
+            )
+            _inflight[cache_key] = task
+            task.add_done_callback(functools.partial(_forget_inflight, cache_key))
+        else:
+            logger.info(f"Waiting for in-flight download of {owner}/{repo}/{folder_path_normalized}")
         
-        # Create a meaningful filename for the download
-        folder_name = folder_path_normalized.split('/')[-1] if folder_path_normalized else repo
-        timestamp = int(time.time())
-        filename = f"{owner}_{repo}_{folder_name}_{timestamp}.zip"
+        # Shield the shared work so one client disconnecting doesn't cancel it for the others
+        result, filename = await asyncio.shield(task)
         
-        # Upload the ZIP file to R2 storage
-        r2_key = f"github-zips/{owner}/{repo}/{filename}"
+        if isinstance(result, ZipStream) and not is_leader:
+            # A stream can only be read once, so followers of a fallback build their own
+            github_api = get_github_api(token)
+            result = await github_api.create_zip_from_folder(owner, repo, folder_path, compress=compress)
         
-        # Upload to R2 and get the URL
-        zip_url = r2_storage.upload_file(zip_buffer, r2_key)
+        return result, filename
         
-        # Calculate expiration time
-        expires_at = datetime.now() + timedelta(hours=link_expiration_hours)
+    except Exception as e:
+        raise HTTPException(status_code=STATUS.get(type(e), 500), detail=str(e))
+
+async def _create_download(
+    owner: str,
+    repo: str,
+    folder_path: str,
+    folder_path_normalized: str,
+    folder_name: str,
+    token: Optional[str],
+    compress: Optional[bool],
+    cache_key: str
+) -> Tuple[Union[Dict, ZipStream, str], str]:
+    """Build and upload the ZIP for a download that isn't cached"""
+    # Get the shared GitHub API client for the optional token
+    github_api = get_github_api(token)
+    
+    # Create a meaningful filename for the download
+    timestamp = int(time.time())
+    filename = f"{owner}_{repo}_{folder_name}_{timestamp}.zip"
+    
+    # GitHub already serves archives of whole repositories; public ones can be
+    # fetched by the client directly, so the bytes never pass through the API.
+    # The link is pinned to the resolved commit like every other download, so a
+    # cached one keeps serving that commit after the branch moves on. Only done
+    # when compression is left unset, since GitHub's archive is always deflated
+    if not folder_path_normalized and compress is None and zipball_redirect:
+        repo_info = await github_api.get_repository(owner, repo)
+        if not repo_info.get('private'):
+            ref = await github_api.resolve_commit_sha(owner, repo)
+            zipball_url = f"https://codeload.github.com/{owner}/{repo}/zip/{ref}"
+            return zipball_url, filename
+    
+    zip_url = None
+    if r2_storage.client:
+        # Archives are stored per commit, so one built earlier for the same commit
+        # and folder is served again instead of being rebuilt and uploaded
+        ref = await github_api.resolve_commit_sha(owner, repo)
+        r2_key = f"github-zips/{owner}/{repo}/{ref}/{_archive_key_name(folder_path_normalized, folder_name, compress)}"
         
-        # Create the response
-        if not zip_url:
-            # Fallback to direct response if R2 upload fails
-            logger.warning("R2 upload failed, returning direct file response")
-            result = zip_buffer, filename
+        loop = asyncio.get_running_loop()
+        existing = await loop.run_in_executor(
+            None, r2_storage.get_reusable_file, r2_key, link_expiration_hours
+        )
+        if existing:
+            logger.info(f"Reusing stored ZIP {r2_key}")
+            zip_url, file_size = existing
         else:
-            # Get file size for response
-            file_size = zip_buffer.getbuffer().nbytes
+            # Build the ZIP in chunks that can be uploaded as multipart parts without another copy
+            zip_stream = await github_api.create_zip_from_folder(
+                owner, repo, folder_path, chunk_size=r2_storage.multipart_chunk_size, compress=compress
+            )
             
-            # Create result dictionary
-            result = {
-                "success": True,
-                "message": "ZIP file created and uploaded successfully",
-                "data": {
-                    "filename": filename,
-                    "download_url": zip_url,
-                    "size_bytes": file_size,
-                    "size_formatted": format_size(file_size),
-                    "expires_in_days": r2_storage.expiration_days,
-                    "expires_at": expires_at.isoformat(),
-                    "r2_key": r2_key,  # Store for link regeneration
-                    "source": {
-                        "owner": owner,
-                        "repo": repo,
-                        "folder_path": folder_path
-                    }
-                }
-            }, filename
-        
-        # Cache the result
-        _download_cache[cache_hash] = {
-            'timestamp': current_time,
-            'result': result[0],  # The response data or buffer
-            'filename': result[1]  # The filename
+            # Stream the ZIP into R2 off the event loop and get the URL
+            zip_url = await loop.run_in_executor(None, r2_storage.upload_stream, zip_stream, r2_key)
+            file_size = zip_stream.bytes_written
+    
+    if not zip_url:
+        # Fallback to a direct streamed response if R2 is unavailable
+        logger.warning("R2 upload failed, returning direct file response")
+        zip_stream = await github_api.create_zip_from_folder(owner, repo, folder_path, compress=compress)
+        return zip_stream, filename
+    
+    # Calculate expiration time
+    expires_at = datetime.now() + timedelta(hours=link_expiration_hours)
+    
+    # Create result dictionary
+    result = {
+        "success": True,
+        "message": "ZIP file created and uploaded successfully",
+        "data": {
+            "filename": filename,
+            "download_url": zip_url,
+            "size_bytes": file_size,
+            "size_formatted": format_size(file_size),
+            "expires_in_days": r2_storage.expiration_days,
+            "expires_at": expires_at.isoformat(),
+            "r2_key": r2_key,  # Store for link regeneration
+            "source": {
+                "owner": owner,
+                "repo": repo,
+                "folder_path": folder_path
+            }
         }
-        
-        return result
-        
-    except Exception as e:
-        error_message = str(e)
-        status_code = 500
-        
-        # Set specific status codes based on error message
-        if "Authentication failed" in error_message:
-            status_code = 401
-        elif "API rate limit exceeded" in error_message:
-            status_code = 429
-        elif "Repository or path not found" in error_message:
-            status_code = 404
-        elif "insufficient permissions" in error_message:
-            status_code = 403
-            
-        raise HTTPException(status_code=status_code, detail=error_message)
+    }
+    
+    # Cache the result metadata only, the ZIP itself lives in R2
+    await download_cache.set(cache_key, {'timestamp': time.time(), 'result': result}, _cache_ttl)
+    
+    return result, filename
+
+def _folder_basename(path: str, fallback: str) -> Tuple[str, str]:
+    """
+    Normalize a requested folder path and get the name to use for its ZIP
+    
+    Returns:
+        Tuple of (path without surrounding slashes, last path segment or fallback)
+    """
+    normalized = path.strip('/')
+    if not normalized:
+        return normalized, fallback
+    
+    segments = normalized.split('/')
+    if '..' in segments:
+        raise InvalidFolderPathError("Folder path must not contain '..' segments")
+    
+    return normalized, segments[-1]
+
+def _archive_key_name(folder_path_normalized: str, folder_name: str, compress: Optional[bool]) -> str:
+    """Get the name a folder's ZIP is stored under in R2, unique per folder and compression"""
+    digest = hashlib.blake2b(f"{folder_path_normalized}:{_compress_key(compress)}".encode(), digest_size=8).hexdigest()
+    return f"{folder_name}-{digest}.zip"
+
+def _compress_key(compress: Optional[bool]) -> str:
+    """Get the cache key part for a compression choice, which may be left unset"""
+    return "auto" if compress is None else str(int(compress))
+
+def _forget_inflight(cache_key: str, task: asyncio.Future):
+    """Drop a finished download from the in-flight table"""
+    if _inflight.get(cache_key) is task:
+        del _inflight[cache_key]
+    
+    # Mark a failure as retrieved even if every waiting request went away
+    if not task.cancelled():
+        task.exception()
 
 def format_size(size_bytes):
     """Format bytes to human-readable size"""
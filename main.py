@@ -1,18 +1,24 @@
+import logging
+
+# Configure logging before the app modules are imported so their import-time
+# messages use it, unless the server has already set up handlers
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from routes.github_routes import router as github_router
 import os
 from dotenv import load_dotenv
-import logging
-import asyncio
 from utils.cleanup_manager import cleanup_manager
 from utils.r2_storage import R2Storage
+from utils.github_api import close_github_apis
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file if it exists
@@ -40,7 +46,8 @@ app = FastAPI(
     You don't need to provide your own token unless you want to access private repositories 
     that the default token doesn't have access to.
     """,
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -52,6 +59,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class JSONGZipMiddleware(GZipMiddleware):
+    """GZip middleware that leaves the ZIP download route alone"""
+    
+    # Streamed ZIP bodies are binary archives; gzipping them would only burn event
+    # loop CPU, and the JSON this route returns is far below the minimum size
+    excluded_paths = ("/api/github/download-folder",)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Compress larger JSON responses such as the OpenAPI schema
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024)
+
 # Include routers
 app.include_router(github_router)
 
@@ -73,6 +96,9 @@ async def shutdown_event():
     if not os.getenv("VERCEL", ""):
         await cleanup_manager.stop()
         logger.info("Stopped background cleanup manager")
+    
+    # Release pooled GitHub connections
+    close_github_apis()
 
 # Root endpoint
 @app.get("/")
@@ -96,8 +122,12 @@ async def trigger_cleanup():
     Manually trigger the cleanup process
     This endpoint is hidden from the docs for security
     """
-    # Run the cleanup in a background task
-    cleanup_task = asyncio.create_task(cleanup_manager._run_cleanup_tasks())
+    # Run the cleanup in a background task, unless one is already running
+    if not cleanup_manager.trigger():
+        return {
+            "message": "Cleanup process is already running",
+            "status": "running"
+        }
     
     return {
         "message": "Cleanup process started",
@@ -107,4 +137,10 @@ async def trigger_cleanup():
 if __name__ == "__main__":
     import uvicorn
     debug_mode = os.getenv("DEBUG", "False").lower() == "true"
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=debug_mode)
+    # uvloop and httptools are picked up automatically when installed; the
+    # reloader only supports a single worker. Workers only share finished
+    # downloads through Redis, and each runs its own R2 cleanup loop, so a
+    # single worker is the default unless REDIS_URL is set
+    default_workers = "2" if os.getenv("REDIS_URL") else "1"
+    workers = 1 if debug_mode else int(os.getenv("WORKERS", default_workers))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=debug_mode, workers=workers)
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Query, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse, RedirectResponse
 from controllers.github_controller import download_folder_as_zip
 from typing import Optional
 import os
@@ -14,30 +14,59 @@ async def download_folder(
     owner: str = Query(..., description="GitHub repository owner/organization"),
     repo: str = Query(..., description="GitHub repository name"),
     folder_path: str = Query("", description="Folder path within the repository (e.g., 'src/components')"),
-    token: Optional[str] = Query(None, description="Optional: Override the default GitHub token for this request")
+    token: Optional[str] = Query(None, description="Optional: Override the default GitHub token for this request"),
+    compress: Optional[bool] = Query(None, description="Deflate the ZIP entries instead of storing them uncompressed"),
+    redirect: bool = Query(False, description="Redirect to the download URL instead of returning it as JSON")
 ):
     """
     Download a specific folder from a GitHub repository as a ZIP file.
     
     ## Notes:
     - If no folder path is specified, downloads the entire repository
+    - If the path points to a single file, the ZIP contains just that file
     - The API uses a default GitHub token for authentication
     - You can optionally provide your own token to override the default one
     - Returns a download URL where the ZIP file can be accessed
+    - With GITHUB_ZIPBALL_REDIRECT=true and compress left unset, whole public
+      repositories are served from GitHub's own ZIP archive of the current commit,
+      whose files sit under a "<repo>-<sha>/" directory
+    - Files are stored uncompressed for speed unless compress=true is given
+    - With redirect=true the client is sent straight to the stored ZIP file
     """
     try:
         # Process the download and get result
-        result, filename = await download_folder_as_zip(owner, repo, folder_path, token)
+        result, filename = await download_folder_as_zip(owner, repo, folder_path, token, compress)
         
         # If result is a dictionary with download_url, return JSON response
         if isinstance(result, dict):
-            return JSONResponse(content=result)
+            if redirect:
+                # Let the client fetch the file from storage directly
+                return RedirectResponse(result["data"]["download_url"], status_code=307)
+            return ORJSONResponse(content=result)
+        elif isinstance(result, str):
+            # Whole public repository, let GitHub serve the archive
+            if redirect:
+                return RedirectResponse(result, status_code=302)
+            return ORJSONResponse(content={
+                "success": True,
+                "message": "ZIP file is served by GitHub",
+                "data": {
+                    "filename": filename,
+                    "download_url": result,
+                    "source": {
+                        "owner": owner,
+                        "repo": repo,
+                        "folder_path": folder_path
+                    }
+                }
+            })
         else:
-            # Fallback to direct file download if R2 storage failed
+            # Fallback to direct streamed download if R2 storage failed; the ZIP is
+            # sent in 64 KiB chunks as it is built, so it is never buffered whole
             return StreamingResponse(
                 result,
                 media_type="application/zip",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
             )
     except HTTPException as e:
         raise e
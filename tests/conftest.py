@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import re
+import sys
+
+import pytest
+import requests
+
+# Import the app's packages from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import github_api  # noqa: E402
+
+
+class FakeResponse:
+    """The parts of requests.Response the GitHub client uses"""
+    
+    def __init__(self, status_code=200, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode("utf-8", "replace")
+        self.headers = headers or {}
+    
+    def json(self):
+        return json.loads(self.content)
+    
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+    
+    def close(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeGitHub:
+    """
+    Serves one repository, o/r at commit abc123, to every requests.Session
+    
+    Blob SHAs are content hashes like Git's, so files with the same content
+    share a blob. Responses queued in replies are sent first, one per request.
+    """
+    
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.replies = []
+    
+    def sha(self, path):
+        return hashlib.sha1(self.files[path]).hexdigest()
+    
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        if self.replies:
+            return self.replies.pop(0)
+        
+        if method == "POST":
+            return self._graphql(kwargs["json"]["query"])
+        if url.endswith("/repos/o/r"):
+            return FakeResponse(200, json.dumps({"private": False, "default_branch": "main"}).encode())
+        if "/commits/" in url:
+            return FakeResponse(200, b"abc123")
+        if "/git/trees/" in url:
+            tree = [
+                {"type": "blob", "path": path, "sha": self.sha(path), "size": len(content)}
+                for path, content in self.files.items()
+            ]
+            return FakeResponse(200, json.dumps({"tree": tree, "truncated": False}).encode())
+        
+        raw_prefix = "https://raw.githubusercontent.com/o/r/abc123/"
+        if url.startswith(raw_prefix) and url[len(raw_prefix):] in self.files:
+            return FakeResponse(200, self.files[url[len(raw_prefix):]])
+        return FakeResponse(404, b'{"message": "Not Found"}')
+    
+    def _graphql(self, query):
+        blobs = {self.sha(path): content for path, content in self.files.items()}
+        repository = {}
+        for name, sha in re.findall(r'(b\d+): object\(oid: "([^"]+)"\)', query):
+            content = blobs[sha]
+            repository[name] = {
+                "byteSize": len(content), "isBinary": False, "isTruncated": False, "text": content.decode()
+            }
+        return FakeResponse(200, json.dumps({"data": {"repository": repository}}).encode())
+
+
+@pytest.fixture
+def fake_github(monkeypatch):
+    """Route every GitHub request to a FakeGitHub, with empty caches"""
+    github = FakeGitHub()
+    monkeypatch.setattr(requests.Session, "request", lambda session, *args, **kwargs: github.request(*args, **kwargs))
+    github_api._shared_cache.clear()
+    github_api._blob_cache.clear()
+    yield github
+    github_api._shared_cache.clear()
+    github_api._blob_cache.clear()
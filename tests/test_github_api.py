@@ -0,0 +1,164 @@
+import asyncio
+import io
+import time
+import zipfile
+
+import pytest
+
+from tests.conftest import FakeResponse
+from utils import github_api
+from utils.github_api import GitHubAPI, _CacheEntry, _shared_cache, close_github_apis, prune_shared_cache
+
+
+def _build_zip(api, folder_path, **kwargs):
+    stream = asyncio.run(api.create_zip_from_folder("o", "r", folder_path, **kwargs))
+    return zipfile.ZipFile(io.BytesIO(b"".join(stream)))
+
+
+@pytest.fixture
+def shared_cache(monkeypatch):
+    monkeypatch.setenv("CACHE_TTL_SECONDS", "300")
+    monkeypatch.setattr(github_api, "_last_prune", float("-inf"))
+    _shared_cache.clear()
+    yield _shared_cache
+    _shared_cache.clear()
+
+
+def _add_entry(key, age, etag=None):
+    entry = _CacheEntry({"key": key}, etag)
+    entry.timestamp = time.monotonic() - age
+    _shared_cache.set(key, entry)
+
+
+def test_prune_drops_revalidatable_entries_past_the_hard_age(shared_cache):
+    _add_entry("fresh", 10, etag='"a"')
+    _add_entry("expired", 400)
+    _add_entry("revalidatable", 400, etag='"b"')
+    _add_entry("stale", 700, etag='"c"')
+    
+    prune_shared_cache()
+    
+    assert sorted(key for key, _ in shared_cache.items()) == ["fresh", "revalidatable"]
+
+
+def test_prune_walks_the_cache_once_per_ttl(shared_cache):
+    prune_shared_cache()
+    _add_entry("expired", 400)
+    
+    prune_shared_cache()
+    
+    assert len(shared_cache) == 1
+
+
+def test_shared_cache_evicts_by_response_size(shared_cache, monkeypatch):
+    monkeypatch.setattr(shared_cache, "max_bytes", 1000)
+    cache = github_api.GitHubAPI()
+    
+    cache._add_to_cache("tree:a", ["a"], '"a"', size=600)
+    cache._add_to_cache("tree:b", ["b"], '"b"', size=600)
+    
+    assert [key for key, _ in shared_cache.items()] == ["tree:b"]
+    assert shared_cache.current_bytes == 600
+
+
+def test_single_file_is_zipped_under_its_own_name(fake_github):
+    fake_github.files = {"docs/guide.md": b"guide", "docs/other.md": b"other"}
+    
+    archive = _build_zip(GitHubAPI(), "docs/guide.md")
+    
+    assert archive.namelist() == ["guide.md"]
+    assert archive.read("guide.md") == b"guide"
+
+
+def test_entry_names_are_cut_past_the_folder_prefix(fake_github):
+    fake_github.files = {"src/lib/src/x.py": b"x", "src/y.py": b"y", "srcx/z.py": b"z"}
+    
+    archive = _build_zip(GitHubAPI(), "/src/")
+    
+    assert sorted(archive.namelist()) == ["lib/src/x.py", "y.py"]
+
+
+def test_duplicate_blobs_are_fetched_once(fake_github, monkeypatch):
+    fake_github.files = {f"licenses/{index}.txt": b"MIT" if index % 2 else b"BSD" for index in range(20)}
+    api = GitHubAPI()
+    api.tarball_min_files = 100
+    fetched = []
+    fetch_zip_entry = api._fetch_zip_entry
+    monkeypatch.setattr(api, "_fetch_zip_entry", lambda item, *args: fetched.append(item) or fetch_zip_entry(item, *args))
+    
+    archive = _build_zip(api, "licenses")
+    
+    assert len(archive.namelist()) == 20
+    assert len(fetched) == 2
+    assert all(archive.read(f"{index}.txt") == fake_github.files[f"licenses/{index}.txt"] for index in range(20))
+
+
+def test_duplicate_blobs_in_graphql_batches_are_fetched_once(fake_github, monkeypatch):
+    fake_github.files = {f"licenses/{index}.txt": b"MIT" if index % 2 else b"BSD" for index in range(20)}
+    api = GitHubAPI("token")
+    api.graphql_batch_size = 3
+    api.tarball_min_files = 100
+    fetched = []
+    fetch_zip_entry = api._fetch_zip_entry
+    monkeypatch.setattr(api, "_fetch_zip_entry", lambda item, *args: fetched.append(item) or fetch_zip_entry(item, *args))
+    
+    archive = _build_zip(api, "licenses")
+    
+    assert len(archive.namelist()) == 20
+    assert len(fetched) == 2
+    assert all(archive.read(f"{index}.txt") == fake_github.files[f"licenses/{index}.txt"] for index in range(20))
+
+
+def test_429_is_only_retried_by_send(fake_github, monkeypatch):
+    monkeypatch.setattr(github_api.time, "sleep", lambda seconds: None)
+    api = GitHubAPI()
+    fake_github.replies = [FakeResponse(429), FakeResponse(200, b"ok")]
+    
+    response = api._send("https://api.github.com/rate-limited")
+    
+    assert response.status_code == 200
+    assert len(fake_github.requests) == 2
+    assert 429 not in api.session.get_adapter("https://api.github.com").max_retries.status_forcelist
+
+
+def test_streamed_archive_releases_its_request_slot(fake_github):
+    api = GitHubAPI()
+    
+    with api._open_stream("https://api.github.com/repos/o/r/zipball/abc123"):
+        assert api._request_slots._active == 0
+
+
+def test_zipball_passthrough_is_skipped_for_explicit_compress(fake_github):
+    fake_github.files = {"README.md": b"readme"}
+    api = GitHubAPI()
+    api.zipball_passthrough = True
+    
+    archive = _build_zip(api, "", compress=False)
+    
+    assert archive.namelist() == ["README.md"]
+    assert not any("/zipball/" in url for _, url in fake_github.requests)
+
+
+def test_shared_pools_are_recreated_after_close():
+    pool = github_api._get_pool("gh-files")
+    
+    close_github_apis()
+    
+    new_pool = github_api._get_pool("gh-files")
+    assert new_pool is not pool
+    assert new_pool.submit(lambda: 42).result() == 42
+
+
+@pytest.mark.parametrize("compresslevel", [1, 3])
+def test_streamed_entries_use_the_archive_compression_level(compresslevel, monkeypatch):
+    levels = []
+    get_compressor = zipfile._get_compressor
+    monkeypatch.setattr(
+        zipfile, "_get_compressor", lambda compress_type, level=None: levels.append(level) or get_compressor(compress_type, level)
+    )
+    content = b"print(1)\n" * 100000
+    
+    with zipfile.ZipFile(io.BytesIO(), "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zip_file:
+        GitHubAPI()._write_zip_entry_from_file(zip_file, "data.py", io.BytesIO(content), len(content))
+    
+    assert levels == [compresslevel]
@@ -0,0 +1,105 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from fastapi import HTTPException
+
+from controllers import github_controller
+from routes import github_routes
+from utils.zip_stream import ZipStream
+
+
+class FakeGitHubAPI:
+    """GitHub client for a public repository whose ZIPs are built locally"""
+    
+    def __init__(self):
+        self.built = []
+    
+    async def get_repository(self, owner, repo):
+        return {"private": False}
+    
+    async def resolve_commit_sha(self, owner, repo, ref=None):
+        return "abc123"
+    
+    async def create_zip_from_folder(self, owner, repo, folder_path, chunk_size=None, compress=None):
+        self.built.append((folder_path, compress))
+        return mock.MagicMock(spec=ZipStream, bytes_written=1024)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeGitHubAPI()
+    monkeypatch.setattr(github_controller, "get_github_api", lambda token=None: api)
+    monkeypatch.setattr(github_controller.r2_storage, "_client", None)
+    monkeypatch.setattr(github_controller.r2_storage, "access_key", None)
+    github_controller.download_cache._entries.clear()
+    return api
+
+
+def test_zipball_redirect_is_off_by_default(api):
+    assert github_controller.zipball_redirect is False
+    
+    result, _ = asyncio.run(github_controller.download_folder_as_zip("o", "r", ""))
+    
+    assert not isinstance(result, str)
+    assert api.built == [("", None)]
+
+
+def test_zipball_redirect_pins_the_commit(api, monkeypatch):
+    monkeypatch.setattr(github_controller, "zipball_redirect", True)
+    
+    result, _ = asyncio.run(github_controller.download_folder_as_zip("o", "r", "/"))
+    
+    assert result == "https://codeload.github.com/o/r/zip/abc123"
+    assert api.built == []
+
+
+def test_zipball_redirect_honours_explicit_compress(api, monkeypatch):
+    monkeypatch.setattr(github_controller, "zipball_redirect", True)
+    
+    result, _ = asyncio.run(github_controller.download_folder_as_zip("o", "r", "", compress=False))
+    
+    assert not isinstance(result, str)
+    assert api.built == [("", False)]
+
+
+def test_zipball_url_is_returned_as_json_without_redirect(api, monkeypatch):
+    monkeypatch.setattr(github_controller, "zipball_redirect", True)
+    
+    response = asyncio.run(github_routes.download_folder("o", "r", "", None, None, False))
+    assert response.status_code == 200
+    assert b'"download_url":"https://codeload.github.com/o/r/zip/abc123"' in response.body
+    
+    response = asyncio.run(github_routes.download_folder("o", "r", "", None, None, True))
+    assert response.status_code == 302
+    assert response.headers["location"] == "https://codeload.github.com/o/r/zip/abc123"
+
+
+def test_parent_segments_in_folder_path_are_rejected(api):
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(github_controller.download_folder_as_zip("o", "r", "src/../../secrets"))
+    
+    assert raised.value.status_code == 400
+    assert api.built == []
+
+
+def test_identical_concurrent_downloads_are_built_once(api, monkeypatch):
+    stored = []
+    monkeypatch.setattr(github_controller.r2_storage, "_client", mock.MagicMock())
+    monkeypatch.setattr(github_controller.r2_storage, "get_reusable_file", lambda key, hours: None)
+    monkeypatch.setattr(
+        github_controller.r2_storage, "upload_stream", lambda stream, key: stored.append(key) or f"https://r2/{key}"
+    )
+    
+    async def download_twice():
+        return await asyncio.gather(
+            github_controller.download_folder_as_zip("o", "r", "src"),
+            github_controller.download_folder_as_zip("o", "r", "/src/")
+        )
+    
+    (first, _), (second, _) = asyncio.run(download_twice())
+    
+    assert first is second
+    assert api.built == [("src", False)]
+    assert len(stored) == 1
+    assert github_controller._inflight == {}
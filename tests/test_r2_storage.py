@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+from botocore.exceptions import EndpointConnectionError, ReadTimeoutError
+
+from utils.r2_storage import (
+    R2Storage,
+    _BufferedHTTPSConnectionPool,
+    _HTTP_WRITE_BUFFER_SIZE,
+    _make_client,
+    _use_large_write_buffer
+)
+
+
+@pytest.fixture
+def storage():
+    storage = R2Storage()
+    storage.bucket_name = "bucket"
+    storage.multipart_chunk_size = 4
+    storage._client = mock.MagicMock()
+    return storage
+
+
+def test_upload_stream_falls_back_when_r2_is_unreachable(storage):
+    storage.client.put_object.side_effect = EndpointConnectionError(endpoint_url="https://r2")
+    
+    assert storage.upload_stream([b"abc"], "key.zip") is None
+
+
+def test_upload_stream_aborts_a_timed_out_multipart_upload(storage):
+    storage.client.create_multipart_upload.return_value = {"UploadId": "u"}
+    storage.client.upload_part.side_effect = ReadTimeoutError(endpoint_url="https://r2")
+    
+    assert storage.upload_stream([b"abcd", b"efgh"], "key.zip") is None
+    storage.client.abort_multipart_upload.assert_called_once_with(Bucket="bucket", Key="key.zip", UploadId="u")
+
+
+def test_upload_stream_raises_errors_from_the_chunk_source(storage):
+    def chunks():
+        yield b"abcd"
+        raise RuntimeError("scan failed")
+    
+    with pytest.raises(RuntimeError):
+        storage.upload_stream(chunks(), "key.zip")
+
+
+def test_get_reusable_file_is_skipped_when_r2_is_unreachable(storage):
+    storage.client.head_object.side_effect = EndpointConnectionError(endpoint_url="https://r2")
+    
+    assert storage.get_reusable_file("key.zip", 24) is None
+
+
+def test_tuned_client_connections_use_the_large_write_buffer(monkeypatch):
+    monkeypatch.setenv("R2_TUNE_HTTP_BUFFER", "1")
+    _make_client.cache_clear()
+    try:
+        client = _make_client("https://r2.example.com", "key", "secret", "auto")
+    finally:
+        _make_client.cache_clear()
+    
+    manager = client._endpoint.http_session._manager
+    assert manager.pool_classes_by_scheme["https"] is _BufferedHTTPSConnectionPool
+    
+    pool = manager.connection_from_url("https://r2.example.com")
+    assert isinstance(pool, _BufferedHTTPSConnectionPool)
+    assert pool._new_conn().blocksize == _HTTP_WRITE_BUFFER_SIZE
+
+
+def test_write_buffer_is_skipped_when_botocore_internals_move(caplog):
+    _use_large_write_buffer(object())
+    
+    assert "write buffer" in caplog.text
+
+
+def test_get_reusable_file_compares_ages_in_utc(storage):
+    storage.cleanup_days = 7
+    storage.public_url = "https://files.example.com"
+    kept_until = datetime.now(timezone.utc) - timedelta(days=storage.cleanup_days)
+    
+    storage.client.head_object.return_value = {"LastModified": kept_until + timedelta(hours=25), "ContentLength": 10}
+    assert storage.get_reusable_file("key.zip", 24) == ("https://files.example.com/key.zip", 10)
+    
+    storage.client.head_object.return_value = {"LastModified": kept_until + timedelta(hours=23), "ContentLength": 10}
+    assert storage.get_reusable_file("key.zip", 24) is None
+
+
+def test_iter_expired_files_compares_ages_in_utc(storage):
+    storage.cleanup_days = 7
+    cutoff = datetime.now(timezone.utc) - timedelta(days=storage.cleanup_days)
+    storage.client.get_paginator.return_value.paginate.return_value = [{"Contents": [
+        {"Key": "old.zip", "LastModified": cutoff - timedelta(minutes=5)},
+        {"Key": "new.zip", "LastModified": cutoff + timedelta(minutes=5)},
+    ]}]
+    
+    assert list(storage.iter_expired_files()) == ["old.zip"]
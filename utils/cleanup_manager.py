@@ -1,4 +1,5 @@
 import asyncio
+import concurrent.futures
 import logging
 import time
 import os
@@ -18,6 +19,16 @@ class CleanupManager:
         self.is_running = False
         self._cleanup_task = None
         
+        # Set while a cleanup pass runs, so scheduled and manual runs never overlap
+        self._cleanup_in_progress = False
+        
+        # Manually triggered run; the event loop only keeps weak references to tasks
+        self._manual_task: Optional[asyncio.Task] = None
+        
+        # Own pool for the slow R2 listing and deletes, so they can't starve the
+        # default executor that request handlers offload work to
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="r2-cleanup")
+        
     async def start(self, r2_storage=None):
         """Start the cleanup task"""
         if r2_storage:
@@ -50,11 +61,25 @@ class CleanupManager:
             self._cleanup_task = None
         logger.info("Cleanup manager stopped")
     
+    def trigger(self) -> bool:
+        """
+        Start a cleanup pass in the background
+        
+        Returns:
+            False if a pass is already running, True otherwise
+        """
+        if self._cleanup_in_progress or (self._manual_task and not self._manual_task.done()):
+            return False
+        
+        self._manual_task = asyncio.create_task(self._run_cleanup_tasks())
+        return True
+    
     async def _run_cleanup_loop(self):
         """Main cleanup loop that runs periodically"""
         try:
             while self.is_running:
-                # Run immediately on startup
+                # Run immediately on startup; errors are handled per pass so a
+                # failure never ends the loop or starts a second one
                 await self._run_cleanup_tasks()
                 
                 # Wait for the next interval
@@ -62,14 +87,14 @@ class CleanupManager:
         except asyncio.CancelledError:
             logger.info("Cleanup loop canceled")
             raise
-        except Exception as e:
-            logger.error(f"Error in cleanup loop: {str(e)}")
-            if self.is_running:
-                # If we're still supposed to be running, restart the loop
-                asyncio.create_task(self._run_cleanup_loop())
     
     async def _run_cleanup_tasks(self):
-        """Run all cleanup tasks"""
+        """Run all cleanup tasks, unless a previous run is still in progress"""
+        if self._cleanup_in_progress:
+            logger.info("Cleanup already in progress, skipping this run")
+            return
+        
+        self._cleanup_in_progress = True
         try:
             # Log the start of cleanup
             logger.info("Starting scheduled cleanup tasks")
@@ -83,6 +108,8 @@ class CleanupManager:
             logger.info(f"Cleanup tasks completed in {elapsed:.2f} seconds")
         except Exception as e:
             logger.error(f"Error running cleanup tasks: {str(e)}")
+        finally:
+            self._cleanup_in_progress = False
     
     async def _cleanup_r2_files(self):
         """Clean up expired files in R2 storage"""
@@ -92,8 +119,8 @@ class CleanupManager:
             
         try:
             # Run the cleanup in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(None, self.r2_storage.cleanup_expired_files)
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, self.r2_storage.cleanup_expired_files)
             
             deleted_count = result.get("deleted_count", 0)
             if deleted_count > 0:
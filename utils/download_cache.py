@@ -0,0 +1,132 @@
+import os
+import time
+import json
+import heapq
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Redis is only needed when REDIS_URL is configured
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+class DownloadCache:
+    """
+    Cache of finished download results (metadata only, never ZIP bytes)
+
+    Entries are stored in Redis when REDIS_URL is set so every worker shares
+    them; otherwise a bounded in-process LRU is used. Keys may contain tokens,
+    so they are hashed before being sent to Redis.
+    """
+
+    def __init__(self, prefix: str = "zip:"):
+        """Initialize the cache from environment settings"""
+        self.prefix = prefix
+        self.max_entries = int(os.getenv("ZIP_CACHE_MAX_ENTRIES", "1024"))
+        self.redis_url = os.getenv("REDIS_URL")
+
+        if self.redis_url and not REDIS_AVAILABLE:
+            logger.warning("REDIS_URL is set but the redis package is not installed, using in-process cache")
+
+        self._redis = None
+        self._entries = OrderedDict()
+        
+        # Min-heap of (expires_at, key) so expired entries can be dropped
+        # without scanning the whole cache
+        self._expiry_heap: List[Tuple[float, str]] = []
+
+    @property
+    def redis(self):
+        """Lazy initialization of the Redis client"""
+        if not self._redis and self.redis_url and REDIS_AVAILABLE:
+            self._redis = aioredis.from_url(self.redis_url)
+        return self._redis
+
+    def _redis_key(self, key: str) -> str:
+        """Build a fixed-width Redis key that doesn't expose the original key"""
+        return self.prefix + hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Get a cached entry if it exists and has not expired"""
+        if self.redis:
+            try:
+                value = await self.redis.get(self._redis_key(key))
+                return json.loads(value) if value else None
+            except Exception as e:
+                logger.warning(f"Error reading download cache from Redis: {str(e)}")
+                return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            # Remove expired entry
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict, ttl: int):
+        """Store an entry for ttl seconds"""
+        if ttl <= 0:
+            await self.delete(key)
+            return
+
+        if self.redis:
+            try:
+                await self.redis.setex(self._redis_key(key), ttl, json.dumps(value))
+            except Exception as e:
+                logger.warning(f"Error writing download cache to Redis: {str(e)}")
+            return
+
+        self._purge_expired()
+        
+        expires_at = time.monotonic() + ttl
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        heapq.heappush(self._expiry_heap, (expires_at, key))
+
+        # Evict least recently used entries beyond the size cap
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        """Remove an entry"""
+        if self.redis:
+            try:
+                await self.redis.delete(self._redis_key(key))
+            except Exception as e:
+                logger.warning(f"Error deleting download cache entry from Redis: {str(e)}")
+            return
+
+        self._entries.pop(key, None)
+
+    def _purge_expired(self):
+        """Drop expired in-process entries, soonest expiry first"""
+        now = time.monotonic()
+        heap = self._expiry_heap
+        
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            
+            # The key may have been replaced or evicted since it was pushed
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires_at:
+                del self._entries[key]
+        
+        # Stale heap items from overwritten or evicted keys are skipped lazily;
+        # rebuild once they outnumber the live entries
+        if len(heap) > 2 * max(len(self._entries), self.max_entries):
+            self._expiry_heap = [(entry[0], key) for key, entry in self._entries.items()]
+            heapq.heapify(self._expiry_heap)
@@ -1,314 +1,1266 @@
 import requests
-import base64
+import asyncio
 import zipfile
+import tarfile
+import tempfile
+import shutil
+import posixpath
 import io
 import os
+import sys
 import time
 import logging
 import concurrent.futures
-from typing import Dict, List, Optional, Set, Any, Tuple
+from typing import Dict, List, Optional, Set, Any, Tuple, Callable, NamedTuple
 from concurrent.futures import ThreadPoolExecutor
-import contextlib
 import queue
+import hashlib
+import functools
+import threading
+from collections import deque
+import weakref
+from urllib.parse import quote
+from urllib3.util.retry import Retry
+from utils.zip_stream import ZipStream
+from utils.memory_cache import MemoryCache
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Set global flag for async availability
 ASYNC_AVAILABLE = False
 logger.info("Using synchronous methods for GitHub API interactions")
 
+# Use ISA-L's SIMD deflate and CRC32 for ZIP entries when it is installed.
+# It supports compression levels 0-3, so zipfile's default maps to level 2
+try:
+    from isal import isal_zlib
+    zipfile.zlib = isal_zlib
+    zipfile.crc32 = isal_zlib.crc32
+    ISAL_AVAILABLE = True
+    logger.info("Using ISA-L for ZIP compression")
+except ImportError:
+    ISAL_AVAILABLE = False
+
+# orjson parses large listings several times faster than the stdlib decoder
+try:
+    import orjson
+    _json_loads = orjson.loads
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+    _json_loads = json.loads
+    ORJSON_AVAILABLE = False
+
+class GitHubAPIError(Exception):
+    """Base class for errors returned by the GitHub API"""
+
+class GitHubAuthError(GitHubAPIError):
+    """The token was missing, invalid or expired"""
+
+class GitHubRateLimitError(GitHubAPIError):
+    """The API rate limit for the token has been used up"""
+
+class GitHubNotFoundError(GitHubAPIError):
+    """The repository or path does not exist or is not visible to the token"""
+
+class GitHubPermissionError(GitHubAPIError):
+    """The token is not allowed to access the resource"""
+
+class _CacheEntry:
+    """A cached API response; slotted since big repositories create many of them"""
+    __slots__ = ('timestamp', 'data', 'etag', 'last_modified', 'size')
+    
+    def __init__(self, data: Any, etag: Optional[str] = None, last_modified: Optional[str] = None, size: int = 0):
+        self.timestamp = time.monotonic()
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        
+        # Size of the response body, used as the entry's share of the cache's byte budget
+        self.size = size
+    
+    @property
+    def revalidatable(self) -> bool:
+        """Whether a conditional request can renew the entry once it expires"""
+        return bool(self.etag or self.last_modified)
+
+class _TreeEntry(NamedTuple):
+    """The fields of a Git tree entry that are used, kept as a tuple to keep big trees small"""
+    type: str
+    path: str
+    sha: str
+    size: Optional[int]
+
+class _RequestLimiter:
+    """Semaphore-like context manager whose limit can be changed while slots are held"""
+    
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._active = 0
+        self._condition = threading.Condition()
+    
+    def set_limit(self, limit: int):
+        """Change the number of concurrent slots; holders above a lowered limit finish normally"""
+        with self._condition:
+            self.limit = max(1, limit)
+            self._condition.notify_all()
+    
+    def __enter__(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+# Cache shared by every GitHubAPI instance. Listings are keyed by commit SHA and
+# ref lookups by token, so entries can be reused safely across requests. The entry
+# cap and a byte budget, measured by response body size since a monorepo's tree
+# listing runs to megabytes, keep memory bounded; freshness is checked on lookup
+# since expired entries with an ETag are kept for revalidation, until
+# prune_shared_cache drops old ones
+_shared_cache = MemoryCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("CACHE_MAX_MB", "128")) * 1024 * 1024,
+    getsizeof=lambda entry: entry.size
+)
+
+# When prune_shared_cache last walked the shared cache
+_last_prune = float("-inf")
+
+# File contents keyed by blob SHA, shared across requests under a byte budget
+# so a few large repositories can't exhaust worker memory. Files above the
+# per-file limit are never cached, so one big asset can't flush everything else
+_blob_cache = MemoryCache(max_bytes=int(os.getenv("BLOB_CACHE_MAX_MB", "64")) * 1024 * 1024)
+_blob_cache_max_file_size = int(os.getenv("BLOB_CACHE_MAX_FILE_KB", "256")) * 1024
+
+# Worker pools shared by every GitHubAPI instance, so archives reuse threads instead
+# of starting and joining pools of their own; threads are only started when needed.
+# Scans wait on directory listings, so they get a pool of their own that listings
+# can't be queued behind
+_cpu_count = os.cpu_count() or 4
+_MAX_WORKERS_CONTENT = min(24, _cpu_count * 2)  # For content API calls
+_MAX_WORKERS_FILES = min(48, _cpu_count * 4)    # For file downloads
+_MAX_WORKERS_SCAN = min(8, _cpu_count * 2)      # For folder scans, one per archive
+_POOL_SIZES = {
+    "gh-contents": _MAX_WORKERS_CONTENT,
+    "gh-files": _MAX_WORKERS_FILES,
+    "gh-scan": _MAX_WORKERS_SCAN,
+}
+
+# Pools are created on first use and dropped by close_github_apis, so a later
+# application startup in the same process gets fresh ones
+_pools: Dict[str, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(name: str) -> ThreadPoolExecutor:
+    """Get a shared worker pool by its thread name prefix, creating it if needed"""
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = ThreadPoolExecutor(max_workers=_POOL_SIZES[name], thread_name_prefix=name)
+    return pool
+
+# Formats that are compressed already and gain nothing from deflate, so they are
+# stored as-is. Anything else is deflated, since repositories hold far more kinds
+# of text (lockfiles, configs, templates, extensionless files) than can be listed
+_INCOMPRESSIBLE_EXTS = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico', '.avif', '.heic',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.jar', '.whl',
+    '.pdf', '.mp3', '.mp4', '.m4a', '.ogg', '.mov', '.webm', '.avi', '.mkv',
+    '.woff', '.woff2', '.parquet', '.onnx'
+})
+
+# Rate limit headers, read from every API response
+_HDR_REMAINING = 'X-RateLimit-Remaining'
+_HDR_RESET = 'X-RateLimit-Reset'
+_HDR_RETRY_AFTER = 'Retry-After'
+_HDR_RESOURCE = 'X-RateLimit-Resource'
+
+# Asks the Git blobs API for the file bytes rather than base64-encoded JSON
+_RAW_BLOB_HEADERS = {"Accept": "application/vnd.github.raw"}
+
+# Instances whose sessions are still open, so they can be closed on shutdown
+_open_apis: "weakref.WeakSet[GitHubAPI]" = weakref.WeakSet()
+
 class GitHubAPI:
     def __init__(self, token: Optional[str] = None):
         """Initialize GitHub API with optional token for authentication"""
         self.base_url = "https://api.github.com"
+        self.raw_url = "https://raw.githubusercontent.com"
         self.headers = {
             "Accept": "application/vnd.github.v3+json",
             # Add user agent to prevent 403 errors
             "User-Agent": "GitHub-Folder-ZIP-API"
         }
         
-        # Use provided token, fallback to environment variable if not provided
-        final_token = token or os.getenv("GITHUB_TOKEN")
-        if final_token:
+        # Use provided token, fallback to the environment if not provided. GITHUB_TOKENS
+        # holds a comma-separated pool of tokens that are rotated per request, each
+        # with its own rate limit budget
+        if token:
+            tokens = [token]
+        else:
+            tokens = [t.strip() for t in os.getenv("GITHUB_TOKENS", "").split(",") if t.strip()]
+            if not tokens and os.getenv("GITHUB_TOKEN"):
+                tokens = [os.getenv("GITHUB_TOKEN")]
+        
+        if len(tokens) == 1:
             # Use Bearer token format which is recommended by GitHub
-            self.headers["Authorization"] = f"Bearer {final_token}"
+            self.headers["Authorization"] = f"Bearer {tokens[0]}"
+        
+        # Identifies the credentials in cache keys without storing the tokens themselves
+        self._auth_key = hashlib.sha256(",".join(tokens).encode()).hexdigest()[:16] if tokens else "anonymous"
         
         # Set up in-memory cache
-        self._cache = {}
+        self._cache = _shared_cache
         self._cache_ttl = int(os.getenv("CACHE_TTL_SECONDS", "300"))  # 5 minutes default
         
-        # Track rate limits
-        self.rate_limit_remaining = 5000
+        # Track rate limits, per Authorization header so pooled tokens are tracked
+        # separately; the totals below cover the whole pool
+        self._token_state = {f"Bearer {t}": {"remaining": 5000, "reset": 0} for t in tokens}
+        self.rate_limit_remaining = 5000 * max(1, len(tokens))
         self.rate_limit_reset = 0
         
-        # Max workers for parallel processing - adjust based on CPU and network
-        cpu_count = os.cpu_count() or 4
-        self.max_workers_content = min(24, cpu_count * 2)  # For content API calls
-        self.max_workers_files = min(48, cpu_count * 4)    # For file downloads
+        # Max workers for parallel processing, the sizes of the shared pools
+        self.max_workers_content = _MAX_WORKERS_CONTENT
+        self.max_workers_files = _MAX_WORKERS_FILES
+        
+        # Bound in-flight requests of every kind (listings and file downloads) so large
+        # folders don't trip GitHub's secondary rate limits
+        self.max_concurrent_requests = int(
+            os.getenv("GITHUB_CONCURRENCY", os.getenv("GITHUB_MAX_CONCURRENT_DOWNLOADS", "16"))
+        )
+        self._request_slots = _RequestLimiter(self.max_concurrent_requests)
+        
+        # Below this many remaining API calls the request limit shrinks in proportion,
+        # spreading what's left of the budget instead of bursting through it
+        self.rate_limit_low_watermark = int(os.getenv("GITHUB_RATE_LIMIT_LOW_WATERMARK", "100"))
+        self._budget_limit = self.max_concurrent_requests
+        
+        # Congestion window on top of the budget: halved whenever GitHub throttles or
+        # fails a request and grown back by half a slot per successful one (AIMD)
+        self._congestion_limit = float(self.max_concurrent_requests)
+        
+        # Size of the chunks handed out while the ZIP is streamed
+        self.zip_chunk_size = 64 * 1024
+        
+        # Deflate at the fastest level, which compresses source code nearly as well
+        # as the default level (and is within the 0-3 range ISA-L supports); files
+        # this small gain next to nothing from deflate and are stored as-is
+        self.zip_compresslevel = 1
+        self.zip_stored_max_size = 1024
+        
+        # Folders with at least this many files, making up at least half of the
+        # repository, are read from a single tarball instead of one request per file
+        self.tarball_min_files = int(os.getenv("GITHUB_TARBALL_MIN_FILES", "20"))
+        
+        # Opt-in: whole-repository downloads without an explicit compression choice relay
+        # GitHub's own zipball. Its entries sit under a "<owner>-<repo>-<sha>/" directory
+        # rather than at the archive root, so enabling this changes the archive layout
+        self.zipball_passthrough = os.getenv("GITHUB_ZIPBALL_PASSTHROUGH", "false").lower() == "true"
+        
+        # Files too large for the blob cache are spooled, keeping at most this much in memory
+        self.spool_max_size = 1024 * 1024
+        
+        # (connect, read) timeouts so a stalled connection can't hang a worker thread
+        self.request_timeout = (5, 30)
+        
+        # Small text files are fetched this many at a time through one GraphQL query
+        # instead of one request each. GraphQL needs a token and spends API points
+        # where raw downloads are free, so batching is off unless a size is set
+        self.graphql_batch_size = int(os.getenv("GITHUB_GRAPHQL_BATCH_SIZE", "0"))
+        self.graphql_max_file_size = 64 * 1024
+        
+        # Rate limited requests are retried this many times, as long as GitHub asks
+        # for a wait of at most rate_limit_max_wait seconds
+        self.rate_limit_retries = 5
+        self.rate_limit_max_wait = int(os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT", "60"))
         
         # Use connection pooling for better performance
         self.session = requests.Session()
         
         # Create a session adapter with optimized settings
+        # Transient failures are retried with backoff, honouring Retry-After; the final
+        # response is returned so API errors are still reported descriptively. Rate limit
+        # replies (403 and 429) are left to _send, so only one layer retries them
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[502, 503, 504],
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
         adapter = requests.adapters.HTTPAdapter(
             pool_connections=self.max_workers_files,
             pool_maxsize=self.max_workers_files,
-            max_retries=3
+            max_retries=retry
         )
         self.session.mount('https://', adapter)
         self.session.mount('http://', adapter)
         
         # For the session, use the same headers
         self.session.headers.update(self.headers)
+        _open_apis.add(self)
     
-    async def get_repository_contents(self, owner: str, repo: str, path: str = "") -> List[Dict]:
+    async def get_repository_contents(self, owner: str, repo: str, path: str = "", ref: Optional[str] = None) -> List[Dict]:
         """Fetch contents of a repository at a specific path"""
-        # For compatibility with async code, we keep the async signature but use synchronous implementation
-        return self._sync_get_repository_contents(owner, repo, path, f"contents:{owner}:{repo}:{path}")
+        # For compatibility with async code, we keep the async signature but run the
+        # synchronous implementation in a worker thread so the event loop isn't blocked
+        ref = ref or await self.resolve_commit_sha(owner, repo)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sync_get_repository_contents, owner, repo, path, ref)
+    
+    async def get_repository(self, owner: str, repo: str) -> Dict:
+        """Fetch repository metadata such as visibility and default branch"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sync_get_repository, owner, repo)
+    
+    def _sync_get_repository(self, owner: str, repo: str) -> Dict:
+        """Synchronous implementation of repository metadata retrieval"""
+        # Visibility depends on who is asking, so key by token
+        cache_key = f"repo:{self._auth_key}:{owner}:{repo}"
+        url = f"{self.base_url}/repos/{owner}/{repo}"
+        return self._sync_get_revalidated(cache_key, url, "Error fetching repository")
     
-    def _sync_get_repository_contents(self, owner: str, repo: str, path: str, cache_key: str) -> List[Dict]:
+    async def resolve_commit_sha(self, owner: str, repo: str, ref: str = "HEAD") -> str:
+        """Resolve a branch, tag or HEAD to the commit SHA it currently points to"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sync_resolve_commit_sha, owner, repo, ref)
+    
+    def _sync_resolve_commit_sha(self, owner: str, repo: str, ref: str = "HEAD") -> str:
+        """Synchronous implementation of ref resolution, revalidated with ETags"""
+        cache_key = f"commit:{self._auth_key}:{owner}:{repo}:{ref}"
+        url = f"{self.base_url}/repos/{owner}/{repo}/commits/{ref}"
+        
+        # Only the SHA is needed, so ask for the compact media type
+        return self._sync_get_revalidated(
+            cache_key,
+            url,
+            "Error resolving repository ref",
+            headers={"Accept": "application/vnd.github.sha"},
+            parse=lambda response: response.text.strip()
+        )
+    
+    def _sync_get_repository_contents(self, owner: str, repo: str, path: str, ref: str) -> List[Dict]:
         """Synchronous implementation of repository contents retrieval"""
-        # Check cache first
+        cache_key = f"contents:{owner}:{repo}:{ref}:{path}"
+        url = f"{self.base_url}/repos/{owner}/{repo}/contents/{path}"
+        return self._sync_get_revalidated(
+            cache_key, url, "Error fetching repository contents", params={"ref": ref}
+        )
+    
+    def _sync_get_revalidated(
+        self,
+        cache_key: str,
+        url: str,
+        error_prefix: str,
+        headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, str]] = None,
+        parse: Callable[[requests.Response], Any] = lambda response: _json_loads(response.content)
+    ) -> Any:
+        """
+        Fetch an API resource through the shared cache
+        
+        Fresh entries are returned directly. Expired entries are revalidated with
+        If-None-Match or If-Modified-Since, and a 304 reply (which doesn't count against the rate limit)
+        renews the cached data instead of downloading it again.
+        """
         cached_data = self._get_from_cache(cache_key)
-        if cached_data:
+        if cached_data is not None:
             return cached_data
-            
-        url = f"{self.base_url}/repos/{owner}/{repo}/contents/{path}"
-        response = self.session.get(url)
+        
+        headers = dict(headers or {})
+        entry = self._cache.get(cache_key)
+        if entry and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        
+        response = self._get(url, headers=headers, params=params)
         
         self._sync_update_rate_limit(response)
         
+        if response.status_code == 304 and entry:
+            entry.timestamp = time.monotonic()
+            return entry.data
+        
+        self._raise_for_api_error(response, error_prefix)
+        
+        data = parse(response)
+        self._add_to_cache(
+            cache_key, data, response.headers.get('ETag'), response.headers.get('Last-Modified'), len(response.content)
+        )
+        return data
+    
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """Send a GET request once one of the instance's request slots is free"""
+        with self._request_slots:
+            return self._send(url, **kwargs)
+    
+    def _send(self, url: str, method: str = "GET", **kwargs) -> requests.Response:
+        """
+        Send a request, waiting out rate limit replies that say when to retry
+        
+        The session's retry policy handles 5xx replies. Rate limit replies are retried
+        here instead: 429, and the 403 GitHub uses for its secondary rate limit and an
+        exhausted primary limit. The caller must hold a request slot, which stays taken
+        while waiting so the other requests slow down as well.
+        """
+        for attempt in range(self.rate_limit_retries + 1):
+            if len(self._token_state) > 1:
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), "Authorization": self._pick_token()}
+            
+            response = self.session.request(method, url, timeout=self.request_timeout, **kwargs)
+            self._update_congestion_limit(response)
+            if attempt == self.rate_limit_retries:
+                return response
+            
+            delay = self._rate_limit_delay(response, attempt)
+            if delay is None:
+                return response
+            
+            response.close()
+            logger.warning(f"GitHub rate limit hit for {url}, retrying in {delay:.1f} seconds")
+            time.sleep(delay)
+    
+    def _update_congestion_limit(self, response):
+        """Shrink the request limit multiplicatively on throttled or failed responses, grow it back additively"""
+        status = response.status_code
+        throttled = status == 429 or status >= 500 or (
+            status == 403
+            and (_HDR_RETRY_AFTER in response.headers or response.headers.get(_HDR_REMAINING) == '0')
+        )
+        if throttled:
+            congestion_limit = max(1.0, self._congestion_limit / 2)
+        elif status < 400:
+            congestion_limit = min(float(self.max_concurrent_requests), self._congestion_limit + 0.5)
+        else:
+            return
+        
+        # Races between threads only lose an adjustment, which the next response makes up for
+        if congestion_limit != self._congestion_limit:
+            self._congestion_limit = congestion_limit
+            self._apply_request_limit()
+    
+    def _apply_request_limit(self):
+        """Set the request limit to the tighter of the budget and congestion limits"""
+        limit = min(self._budget_limit, int(self._congestion_limit))
+        if limit != self._request_slots.limit:
+            self._request_slots.set_limit(limit)
+    
+    def _graphql(self, query: str, variables: Dict[str, Any]) -> Dict:
+        """Run a GraphQL query and return its data"""
+        with self._request_slots:
+            response = self._send(
+                f"{self.base_url}/graphql", method="POST", json={"query": query, "variables": variables}
+            )
+        
+        # GraphQL has a separate points budget, so its rate limit headers aren't tracked
+        self._raise_for_api_error(response, "Error querying GitHub GraphQL API")
+        
+        result = _json_loads(response.content)
+        if result.get("errors") and not result.get("data"):
+            raise GitHubAPIError(f"Error querying GitHub GraphQL API: {result['errors'][0].get('message', 'Unknown error')}")
+        return result["data"]
+    
+    def _pick_token(self) -> str:
+        """Get the Authorization header of the pooled token with the most requests left"""
+        now = time.time()
+        available = [
+            auth for auth, state in self._token_state.items()
+            if state["remaining"] > 0 or state["reset"] <= now
+        ]
+        if not available:
+            # Every token is exhausted; the one that resets first recovers first
+            return min(self._token_state, key=lambda auth: self._token_state[auth]["reset"])
+        return max(available, key=lambda auth: self._token_state[auth]["remaining"])
+    
+    def _rate_limit_delay(self, response, attempt: int) -> Optional[float]:
+        """Get how long to wait before retrying a rate limited response, or None to not retry"""
+        if response.status_code not in (403, 429):
+            return None
+        
+        retry_after = response.headers.get(_HDR_RETRY_AFTER)
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                return None
+        elif response.headers.get(_HDR_REMAINING) == '0':
+            try:
+                delay = int(response.headers.get(_HDR_RESET, 0)) - time.time()
+            except ValueError:
+                return None
+        elif response.status_code == 429:
+            # Throttled without saying for how long, so just back off
+            delay = 0
+        else:
+            # A plain 403 means the token lacks access, which waiting won't fix
+            return None
+        
+        # Back off at least exponentially, but fail fast rather than stall a download for long
+        delay = max(delay, 2 ** attempt)
+        if delay > self.rate_limit_max_wait:
+            return None
+        return delay
+    
+    async def get_tree(self, owner: str, repo: str, ref: str) -> Dict:
+        """Fetch the full recursive file tree of a commit"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sync_get_tree, owner, repo, ref)
+    
+    def _sync_get_tree(self, owner: str, repo: str, ref: str, recursive: bool = True) -> Dict:
+        """Synchronous implementation of tree retrieval, recursive unless told otherwise"""
+        cache_key = f"tree:{owner}:{repo}:{ref}" if recursive else f"tree-flat:{owner}:{repo}:{ref}"
+        
+        # One request lists every file, instead of one request per directory
+        url = f"{self.base_url}/repos/{owner}/{repo}/git/trees/{ref}"
+        return self._sync_get_revalidated(
+            cache_key,
+            url,
+            "Error fetching repository tree",
+            params={"recursive": "1"} if recursive else None,
+            parse=self._parse_tree
+        )
+    
+    @staticmethod
+    def _parse_tree(response: requests.Response) -> Dict:
+        """Parse a tree listing, keeping only the entry fields that are used"""
+        data = _json_loads(response.content)
+        
+        # Every entry's type is one of a few words, so share one string object for
+        # each rather than keeping a copy per entry in cached trees
+        return {
+            "truncated": data.get("truncated", False),
+            "tree": [
+                _TreeEntry(sys.intern(entry["type"]), entry["path"], entry["sha"], entry.get("size"))
+                for entry in data["tree"]
+            ]
+        }
+    
+    async def get_folder_tree(self, owner: str, repo: str, ref: str, folder_path: str) -> Optional[Dict]:
+        """Fetch the recursive tree of a single folder"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sync_get_folder_tree, owner, repo, ref, folder_path)
+    
+    def _sync_get_folder_tree(self, owner: str, repo: str, ref: str, folder_path: str) -> Optional[Dict]:
+        """
+        Synchronous implementation of folder tree retrieval
+        
+        Walks down to the folder one tree level at a time and lists just its subtree,
+        for repositories too large to list in one response. Returns None if the path
+        is not a folder.
+        """
+        sha = ref
+        for segment in folder_path.strip('/').split('/'):
+            level = self._sync_get_tree(owner, repo, sha, recursive=False)
+            entry = next((item for item in level["tree"] if item.path == segment), None)
+            if entry is None:
+                raise GitHubNotFoundError("Repository or path not found. Check if the repository is private and you have access to it.")
+            if entry.type != "tree":
+                return None
+            sha = entry.sha
+        
+        return self._sync_get_tree(owner, repo, sha)
+    
+    def _files_in_tree(
+        self,
+        owner: str,
+        repo: str,
+        ref: str,
+        tree: List[_TreeEntry],
+        folder_path: str,
+        tree_root: str = ""
+    ) -> List[Dict]:
+        """
+        Get the files below a folder from a recursive tree, shaped like contents API items
+        
+        If the path names a file rather than a folder, that file is the only item.
+        tree_root is the repository path the tree was listed from, prefixed to its paths.
+        """
+        path = folder_path.strip('/')
+        prefix = f"{path}/" if path else ""
+        root = f"{tree_root}/" if tree_root else ""
+        
+        files = []
+        for entry in tree:
+            if entry.type != "blob":
+                continue
+            entry_path = root + entry.path
+            if not entry_path.startswith(prefix) and entry_path != path:
+                continue
+            files.append({
+                "type": "file",
+                "path": entry_path,
+                "sha": entry.sha,
+                "size": entry.size,
+                "download_url": f"{self.raw_url}/{owner}/{repo}/{ref}/{quote(entry_path)}",
+                "git_url": f"{self.base_url}/repos/{owner}/{repo}/git/blobs/{entry.sha}"
+            })
+        
+        if not files and prefix:
+            # Match the contents API, which 404s for folders that don't exist
+            raise GitHubNotFoundError("Repository or path not found. Check if the repository is private and you have access to it.")
+        
+        return files
+    
+    def _rate_limit_error(self) -> GitHubRateLimitError:
+        """Build the error for an exhausted rate limit, saying when it resets"""
+        reset_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.rate_limit_reset))
+        return GitHubRateLimitError(f"GitHub API rate limit exceeded. Resets at {reset_time}")
+    
+    def _raise_for_api_error(self, response, error_prefix: str):
+        """Raise a descriptive error for unsuccessful GitHub API responses"""
         if response.status_code == 401:
-            raise Exception("Authentication failed. Please provide a valid GitHub token with sufficient permissions.")
+            raise GitHubAuthError("Authentication failed. Please provide a valid GitHub token with sufficient permissions.")
         elif response.status_code == 403:
             if self.rate_limit_remaining == 0:
-                reset_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.rate_limit_reset))
-                raise Exception(f"GitHub API rate limit exceeded. Resets at {reset_time}")
-            raise Exception("Insufficient permissions. Try using a GitHub token with 'repo' scope.")
+                raise self._rate_limit_error()
+            raise GitHubPermissionError("Insufficient permissions. Try using a GitHub token with 'repo' scope.")
         elif response.status_code == 404:
-            raise Exception(f"Repository or path not found. Check if the repository is private and you have access to it.")
+            raise GitHubNotFoundError(f"Repository or path not found. Check if the repository is private and you have access to it.")
         elif response.status_code != 200:
             message = response.json().get('message', 'Unknown error')
-            raise Exception(f"Error fetching repository contents: {message}")
-        
-        data = response.json()
-        # Store in cache
-        self._add_to_cache(cache_key, data)
-        return data
+            raise GitHubAPIError(f"{error_prefix}: {message}")
 
-    async def create_zip_from_folder(self, owner: str, repo: str, folder_path: str) -> io.BytesIO:
-        """Create a ZIP file from a folder in a GitHub repository"""
-        start_time = time.time()
-        logger.info(f"Starting ZIP creation for {owner}/{repo}/{folder_path}")
+    async def create_zip_from_folder(
+        self,
+        owner: str,
+        repo: str,
+        folder_path: str,
+        chunk_size: Optional[int] = None,
+        compress: Optional[bool] = None
+    ) -> ZipStream:
+        """
+        Create a ZIP file from a folder in a GitHub repository
         
-        # Get the folder contents and build repository structure
-        contents = await self.get_repository_contents(owner, repo, folder_path)
-        
-        # Use a queue and worker threads to process files as they're discovered
-        # instead of waiting for the full scan to complete
-        zip_buffer = io.BytesIO()
-        file_queue = queue.Queue()
-        total_files_counter = [0]  # Use a list for a mutable integer reference
-        processed_files_counter = [0]
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Start file processing workers that will take items from the queue
-            with ThreadPoolExecutor(max_workers=self.max_workers_files) as executor:
-                # Start worker threads that will process the file queue
-                futures = []
-                for _ in range(self.max_workers_files):
-                    future = executor.submit(
-                        self._worker_process_file_queue, 
-                        zip_file, 
-                        file_queue, 
-                        total_files_counter,
-                        processed_files_counter,
-                        folder_path
-                    )
-                    futures.append(future)
-                
-                # Scan repository in parallel with processing
-                self._scan_and_enqueue_files(
-                    owner, 
-                    repo, 
-                    folder_path, 
-                    contents, 
-                    file_queue, 
-                    total_files_counter
+        The folder listing is fetched up front so lookup errors surface to the caller
+        before any bytes are produced. The archive itself is built on a background
+        thread while the returned stream is consumed, so it never sits in memory whole.
+        chunk_size sets the size of the chunks the stream yields. Entries are stored
+        uncompressed unless compress is set, since most repository content is either
+        small or already compressed and deflate would only delay the stream. With
+        compress left as None, a whole repository may be relayed as GitHub's zipball.
+        """
+        # Pin the download to one commit so every listing is content-addressed
+        ref = await self.resolve_commit_sha(owner, repo)
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        
+        # GitHub already serves the whole repository as one archive, so relay it
+        # rather than listing and fetching every file. Its entries are deflated, so
+        # it's only used when the caller didn't ask for a compression either way
+        if not folder_path.strip('/') and self.zipball_passthrough and compress is None:
+            return ZipStream(
+                lambda output: self._write_zipball(output, owner, repo, ref),
+                chunk_size=chunk_size or self.zip_chunk_size
+            )
+        
+        # List every file in one request; very large trees come back truncated,
+        # so list just the folder's subtree, and failing that walk it directory by directory
+        tree = await self.get_tree(owner, repo, ref)
+        if tree.get("truncated"):
+            folder_tree = None
+            if folder_path.strip('/'):
+                folder_tree = await self.get_folder_tree(owner, repo, ref, folder_path)
+            
+            if folder_tree and not folder_tree.get("truncated"):
+                contents = self._files_in_tree(
+                    owner, repo, ref, folder_tree["tree"], folder_path, tree_root=folder_path.strip('/')
                 )
+            else:
+                logger.info(f"Tree for {owner}/{repo} is truncated, listing {folder_path or '/'} per directory")
+                contents = await self.get_repository_contents(owner, repo, folder_path, ref)
                 
-                # Mark queue as done for all workers
-                file_queue.put(None)
-                
-                # Wait for all worker threads to complete
-                for future in futures:
-                    # This will re-raise any exceptions from the worker threads
-                    future.result()
+                # The contents API describes a file path with a single object
+                if isinstance(contents, dict):
+                    contents = [contents]
+        else:
+            contents = self._files_in_tree(owner, repo, ref, tree["tree"], folder_path)
+            
+            if self._prefer_tarball(tree["tree"], contents):
+                return ZipStream(
+                    lambda output: self._write_zip_from_tarball(output, owner, repo, ref, folder_path, compression),
+                    chunk_size=chunk_size or self.zip_chunk_size
+                )
+        
+        # A single file is zipped under its own name rather than its full path
+        if len(contents) == 1 and contents[0]["type"] == "file" and contents[0]["path"] == folder_path.strip('/'):
+            folder_path = posixpath.dirname(contents[0]["path"])
+        
+        return ZipStream(
+            lambda output: self._write_zip(output, owner, repo, ref, folder_path, contents, compression),
+            chunk_size=chunk_size or self.zip_chunk_size
+        )
+    
+    def _prefer_tarball(self, tree: List[_TreeEntry], files: List[Dict]) -> bool:
+        """Check whether the repository tarball is cheaper than fetching the files one by one"""
+        if len(files) < self.tarball_min_files:
+            return False
+        
+        # The tarball holds the whole repository, so only use it when the folder is most of it
+        folder_bytes = sum(item["size"] or 0 for item in files)
+        repo_bytes = sum(entry.size or 0 for entry in tree if entry.type == "blob")
+        return folder_bytes * 2 >= repo_bytes
+    
+    def _write_zipball(self, output, owner, repo, ref):
+        """Copy the repository zipball into a file-like object as it downloads"""
+        start_time = time.time()
+        logger.info(f"Relaying zipball for {owner}/{repo}@{ref}")
         
-        # Reset the buffer position to the beginning
-        zip_buffer.seek(0)
+        url = f"{self.base_url}/repos/{owner}/{repo}/zipball/{ref}"
+        with self._open_stream(url) as response:
+            self._raise_for_api_error(response, "Error downloading repository zipball")
+            
+            for chunk in response.iter_content(chunk_size=self.zip_chunk_size):
+                output.write(chunk)
         
         end_time = time.time()
-        logger.info(f"ZIP creation completed in {end_time - start_time:.2f} seconds")
-        return zip_buffer
-    
-    def _scan_and_enqueue_files(self, owner, repo, folder_path, contents, file_queue, total_files_counter):
-        """Scan repository and add files to the processing queue as they're discovered"""
-        # Process this level's files immediately
-        for item in contents:
-            if item["type"] == "file":
-                file_queue.put(item)
-                total_files_counter[0] += 1
-        
-        # Process subdirectories in parallel
-        with ThreadPoolExecutor(max_workers=self.max_workers_content) as executor:
-            futures = []
-            for item in contents:
-                if item["type"] == "dir":
-                    future = executor.submit(
-                        self._process_subdirectory,
-                        owner, 
-                        repo, 
-                        item["path"], 
-                        file_queue, 
-                        total_files_counter
-                    )
-                    futures.append(future)
+        logger.info(f"Zipball relay completed in {end_time - start_time:.2f} seconds")
+    
+    def _write_zip_from_tarball(self, output, owner, repo, ref, folder_path, compression=zipfile.ZIP_STORED):
+        """Write the ZIP archive for a folder from the repository tarball, in one streamed download"""
+        start_time = time.time()
+        logger.info(f"Starting ZIP creation for {owner}/{repo}/{folder_path} from tarball")
+        
+        prefix = folder_path.strip('/')
+        prefix = f"{prefix}/" if prefix else ""
+        
+        url = f"{self.base_url}/repos/{owner}/{repo}/tarball/{ref}"
+        with self._open_stream(url) as response:
+            self._raise_for_api_error(response, "Error downloading repository tarball")
             
-            # Wait for all directory processing to complete
-            for future in futures:
-                # This will re-raise any exceptions
-                future.result()
-    
-    def _process_subdirectory(self, owner, repo, dir_path, file_queue, total_files_counter):
-        """Process a subdirectory and add its files to the queue"""
-        contents = self._sync_get_repository_contents(
-            owner, repo, dir_path, f"contents:{owner}:{repo}:{dir_path}"
+            file_count = 0
+            with zipfile.ZipFile(output, 'w', compression, compresslevel=self.zip_compresslevel) as zip_file:
+                # Stream mode reads members in order without seeking the response
+                with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
+                    for member in tar:
+                        # Member names start with a "<owner>-<repo>-<sha>/" directory
+                        path = member.name.split('/', 1)[1] if '/' in member.name else ""
+                        if not member.isfile() or not path.startswith(prefix):
+                            continue
+                        
+                        if member.size > _blob_cache_max_file_size:
+                            self._write_zip_entry_from_file(
+                                zip_file, path[len(prefix):], tar.extractfile(member), member.size
+                            )
+                        else:
+                            file_content = tar.extractfile(member).read()
+                            self._write_zip_entry(zip_file, path[len(prefix):], file_content)
+                        file_count += 1
+        
+        end_time = time.time()
+        logger.info(f"ZIP creation of {file_count} files completed in {end_time - start_time:.2f} seconds")
+    
+    def _open_stream(self, url: str) -> requests.Response:
+        """
+        Start a streamed download, holding a request slot only until the headers arrive
+        
+        The body is read at the pace of whoever consumes the archive, which can be slow,
+        so it is read outside the slot and can't hold up other requests for the token.
+        """
+        with self._request_slots:
+            response = self._send(url, stream=True)
+        
+        self._sync_update_rate_limit(response)
+        return response
+    
+    def _entry_compress_type(self, zip_file, rel_path: str, size: int) -> int:
+        """Pick the compression for an entry; tiny files and already compressed formats are stored"""
+        if size <= self.zip_stored_max_size:
+            return zipfile.ZIP_STORED
+        if os.path.splitext(rel_path)[1].lower() in _INCOMPRESSIBLE_EXTS:
+            return zipfile.ZIP_STORED
+        return zip_file.compression
+    
+    def _write_zip_entry(self, zip_file, rel_path: str, file_content: bytes):
+        """Add a file to an archive using its compression where it pays off"""
+        zip_file.writestr(
+            rel_path,
+            file_content,
+            compress_type=self._entry_compress_type(zip_file, rel_path, len(file_content))
         )
+    
+    def _write_zip_entry_from_file(self, zip_file, rel_path: str, fileobj, size: int):
+        """Copy a large file into an archive entry in chunks, without reading it whole"""
+        zinfo = zipfile.ZipInfo(rel_path, date_time=time.localtime(time.time())[:6])
+        zinfo.external_attr = 0o600 << 16  # Same permissions writestr gives entries
+        zinfo.compress_type = self._entry_compress_type(zip_file, rel_path, size)
+        # Use the archive's level like writestr does; ZipInfo only has a public
+        # compress_level from Python 3.13 on, older versions read _compresslevel
+        if sys.version_info >= (3, 13):
+            zinfo.compress_level = zip_file.compresslevel
+        else:
+            zinfo._compresslevel = zip_file.compresslevel
         
-        # Add files to queue immediately
-        for item in contents:
-            if item["type"] == "file":
-                file_queue.put(item)
-                total_files_counter[0] += 1
-            elif item["type"] == "dir":
-                # Recursively process nested directories
-                self._process_subdirectory(owner, repo, item["path"], file_queue, total_files_counter)
-    
-    def _worker_process_file_queue(self, zip_file, file_queue, total_files_counter, processed_files_counter, base_folder):
-        """Worker thread function to process files from the queue"""
-        while True:
-            # Get the next file from the queue
-            item = file_queue.get()
-            
-            # None is our signal to stop
-            if item is None:
-                # Put None back for other workers
-                file_queue.put(None)
-                break
+        # Entries are streamed, so ZIP64 has to be decided up front; with the expected
+        # size set, zipfile only uses ZIP64 headers for entries that may need them
+        zinfo.file_size = size
+        with zip_file.open(zinfo, 'w') as entry:
+            shutil.copyfileobj(fileobj, entry, self.zip_chunk_size)
+    
+    def _write_zip(self, output, owner, repo, ref, folder_path, contents, compression=zipfile.ZIP_STORED):
+        """Write the ZIP archive for a folder into a file-like object"""
+        start_time = time.time()
+        logger.info(f"Starting ZIP creation for {owner}/{repo}/{folder_path}")
+        
+        # Files are queued as the scan discovers them, downloaded on a bounded
+        # pool and written here as they finish, so this thread is the only
+        # writer and ZipFile needs no lock. The queue is bounded so a scan that
+        # outruns the downloads waits instead of piling up file entries
+        file_queue = queue.Queue(maxsize=self.max_workers_files * 4)
+        total_files_counter = [0]  # Use a list for a mutable integer reference, only the scan adds to it
+        processed_files = 0
+        
+        # Cap in-flight downloads so finished bodies can't pile up in memory
+        # while the writer is busy
+        max_pending = self.max_workers_files * 2
+        
+        # Every file path starts with the folder, so entry names are a slice past it
+        base_folder = folder_path.strip('/')
+        base_prefix_len = len(base_folder) + 1 if base_folder else 0
+        
+        # Tells the scan to stop once the archive is abandoned
+        stopped = threading.Event()
+        
+        # Files sharing a blob SHA with one being downloaded, alone or in a batch,
+        # reuse its body: the SHA maps to the copies' entry names, and each download
+        # to the SHAs of its entries in order, so each blob is fetched once per archive
+        pending = set()
+        shared_blobs = {}
+        future_shas = {}
+        file_pool = _get_pool("gh-files")
+        
+        def submit_batch(items):
+            future = file_pool.submit(self._fetch_zip_batch, owner, repo, items, base_prefix_len)
+            pending.add(future)
+            future_shas[future] = [item["sha"] for item in items]
+        
+        with zipfile.ZipFile(output, 'w', compression, compresslevel=self.zip_compresslevel) as zip_file:
+            # Scan repository in parallel with downloading
+            scan_future = _get_pool("gh-scan").submit(
+                self._scan_and_enqueue_files,
+                owner, 
+                repo, 
+                ref, 
+                folder_path, 
+                contents, 
+                file_queue, 
+                total_files_counter,
+                stopped
+            )
             
             try:
-                # Process the file
-                rel_path = item["path"]
-                if base_folder:
-                    # Remove the base folder from the path to maintain correct structure
-                    rel_path = rel_path.replace(base_folder, "").lstrip("/")
-                
-                # Get file content
-                file_content = self._sync_get_file_content_cached(item["download_url"])
+                batch = []
+                scan_done = False
+                while not scan_done or pending:
+                    # Top up the window with newly discovered files
+                    while not scan_done and len(pending) < max_pending:
+                        try:
+                            item = file_queue.get(timeout=None if not (pending or batch) else 0.05)
+                        except queue.Empty:
+                            break
+                        
+                        # None is the end-of-scan signal
+                        if item is None:
+                            scan_done = True
+                            break
+                        
+                        sha = item.get("sha")
+                        if sha in shared_blobs:
+                            shared_blobs[sha].append(item["path"][base_prefix_len:])
+                            continue
+                        if sha:
+                            shared_blobs[sha] = []
+                        
+                        if self._is_batchable(item):
+                            batch.append(item)
+                            if len(batch) >= self.graphql_batch_size:
+                                submit_batch(batch)
+                                batch = []
+                            continue
+                        
+                        future = file_pool.submit(self._fetch_zip_entry, item, base_prefix_len)
+                        pending.add(future)
+                        future_shas[future] = [sha]
+                    
+                    # Send a partial batch once the scan has nothing more to hand out for now
+                    if batch:
+                        submit_batch(batch)
+                        batch = []
+                    
+                    if not pending:
+                        continue
+                    
+                    done, pending = concurrent.futures.wait(
+                        pending,
+                        timeout=None if scan_done else 0.05,
+                        return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        # Batches produce a list of entries, single downloads one entry
+                        entries = future.result()
+                        if not isinstance(entries, list):
+                            entries = [entries]
+                        
+                        for entry, sha in zip(entries, future_shas.pop(future)):
+                            copies = shared_blobs.pop(sha) if sha else []
+                            if entry is None:
+                                if copies:
+                                    logger.error(f"Skipping {len(copies)} copies of blob {sha} after its download failed")
+                                continue
+                            
+                            rel_path, body, size = entry
+                            try:
+                                for entry_path in [rel_path] + copies:
+                                    if isinstance(body, bytes):
+                                        self._write_zip_entry(zip_file, entry_path, body)
+                                    else:
+                                        body.seek(0)
+                                        self._write_zip_entry_from_file(zip_file, entry_path, body, size)
+                                    
+                                    # Report progress at appropriate intervals
+                                    processed_files += 1
+                                    total = total_files_counter[0]
+                                    if processed_files % 10 == 0 or processed_files == total:
+                                        if total > 0:
+                                            logger.info(f"Progress: {processed_files}/{total} files ({processed_files/total*100:.1f}%)")
+                                        else:
+                                            logger.info(f"Progress: {processed_files} files processed")
+                            finally:
+                                # Spooled bodies are written once per copy, then removed
+                                if not isinstance(body, bytes):
+                                    body.close()
                 
-                # Add to ZIP with acquired lock to ensure thread safety
-                with self._acquire_zip_lock(zip_file):
-                    zip_file.writestr(rel_path, file_content)
+                # This will re-raise any exceptions from the scan
+                scan_future.result()
+            finally:
+                # Stop fetching for an archive that is no longer being read, since the
+                # pools are shared with other downloads
+                stopped.set()
+                for future in pending:
+                    future.cancel()
+        
+        end_time = time.time()
+        logger.info(f"ZIP creation completed in {end_time - start_time:.2f} seconds")
+    
+    def _scan_and_enqueue_files(self, owner, repo, ref, folder_path, contents, file_queue, total_files_counter, stopped):
+        """
+        Scan repository and add files to the processing queue as they're discovered
+        
+        Directories are walked breadth first, without recursion: every directory
+        of a level is listed in parallel and their subdirectories form the next level.
+        The walk ends early once the stopped event is set.
+        """
+        try:
+            frontier = deque([contents])
+            while frontier and not stopped.is_set():
+                dir_paths = []
+                while frontier:
+                    for item in frontier.popleft():
+                        if item["type"] == "file":
+                            if not self._put_until_stopped(file_queue, item, stopped):
+                                return
+                            total_files_counter[0] += 1
+                        elif item["type"] == "dir":
+                            dir_paths.append(item["path"])
                 
-                # Update progress counter
-                with contextlib.suppress(Exception):
-                    processed_files_counter[0] += 1
-                    total = total_files_counter[0]
-                    processed = processed_files_counter[0]
-                    
-                    # Report progress at appropriate intervals
-                    if processed % 10 == 0 or processed == total:
-                        if total > 0:
-                            logger.info(f"Progress: {processed}/{total} files ({processed/total*100:.1f}%)")
-                        else:
-                            logger.info(f"Progress: {processed} files processed")
+                # This will re-raise any exceptions from the listings
+                frontier.extend(_get_pool("gh-contents").map(
+                    lambda dir_path: self._sync_get_repository_contents(owner, repo, dir_path, ref),
+                    dir_paths
+                ))
+        finally:
+            # Always release the writer, even if the scan failed
+            self._put_until_stopped(file_queue, None, stopped)
+    
+    @staticmethod
+    def _put_until_stopped(file_queue, item, stopped) -> bool:
+        """Put an item on the bounded file queue, giving up once the writer has stopped"""
+        while not stopped.is_set():
+            try:
+                file_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _fetch_zip_entry(self, item, base_prefix_len: int):
+        """
+        Download one file for the archive, returning (rel_path, body, size) or None if it failed
+        
+        base_prefix_len is the length of the folder path and its trailing slash,
+        which are cut from the file path to maintain the folder's structure.
+        """
+        try:
+            rel_path = item["path"][base_prefix_len:]
             
-            except Exception as e:
-                logger.error(f"Error processing file {item['path']}: {str(e)}")
+            size = item.get("size") or 0
+            if size > _blob_cache_max_file_size:
+                # Too big to cache, so spool it instead of holding the whole body in memory
+                return rel_path, self._sync_download_to_spool(item["download_url"], item.get("git_url")), size
             
-            finally:
-                # Mark this task as done
-                file_queue.task_done()
+            file_content = self._sync_get_file_content_cached(item["download_url"], item.get("sha"), item.get("git_url"))
+            return rel_path, file_content, size
+        
+        except Exception as e:
+            logger.error(f"Error processing file {item['path']}: {str(e)}")
+            return None
+    
+    def _is_batchable(self, item) -> bool:
+        """Check whether a file can be fetched as part of a GraphQL batch"""
+        if self.graphql_batch_size <= 0 or not self._token_state or not item.get("sha"):
+            return False
+        if (item.get("size") or 0) > self.graphql_max_file_size:
+            return False
+        
+        # GraphQL only returns the text of blobs, so likely binary files are fetched directly
+        return os.path.splitext(item["path"])[1].lower() not in _INCOMPRESSIBLE_EXTS
     
-    @contextlib.contextmanager
-    def _acquire_zip_lock(self, zip_file):
-        """Context manager for thread-safe access to the ZIP file"""
-        # ZipFile is not thread-safe, so we use this as a placeholder
-        # In a real implementation, you'd use a threading.Lock here
-        yield
+    def _fetch_zip_batch(self, owner, repo, items, base_prefix_len: int):
+        """
+        Download a batch of small files, returning a list of _fetch_zip_entry results
+        
+        The text of every blob that isn't cached is fetched with one GraphQL query
+        and put in the blob cache. Files GraphQL can't return intact (binary ones,
+        or text that doesn't add up to the blob size) are downloaded one by one.
+        """
+        shas = list({item["sha"] for item in items if _blob_cache.get(item["sha"]) is None})
+        if shas:
+            try:
+                for sha, file_content in self._sync_get_blob_texts(owner, repo, shas).items():
+                    _blob_cache.set(sha, file_content)
+            except Exception as e:
+                logger.warning(f"GraphQL batch of {len(shas)} files failed, downloading them one by one: {str(e)}")
+        
+        return [self._fetch_zip_entry(item, base_prefix_len) for item in items]
     
-    def _sync_get_file_content_cached(self, download_url: str) -> bytes:
+    def _sync_get_blob_texts(self, owner: str, repo: str, shas: List[str]) -> Dict[str, bytes]:
+        """Fetch the contents of text blobs by SHA in one GraphQL query"""
+        fields = " ".join(
+            f'b{index}: object(oid: "{sha}") {{ ... on Blob {{ byteSize isBinary isTruncated text }} }}'
+            for index, sha in enumerate(shas)
+        )
+        query = f"query($owner: String!, $name: String!) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}"
+        repository = self._graphql(query, {"owner": owner, "name": repo}).get("repository") or {}
+        
+        contents = {}
+        for index, sha in enumerate(shas):
+            blob = repository.get(f"b{index}")
+            if not blob or blob["isBinary"] or blob["isTruncated"] or blob["text"] is None:
+                continue
+            
+            # Text that wasn't UTF-8 doesn't survive the round trip, which shows in its size
+            file_content = blob["text"].encode("utf-8")
+            if len(file_content) == blob["byteSize"]:
+                contents[sha] = file_content
+        
+        return contents
+    
+    def _sync_get_file_content_cached(
+        self,
+        download_url: str,
+        blob_sha: Optional[str] = None,
+        blob_url: Optional[str] = None
+    ) -> bytes:
         """Get file content with caching"""
+        # Without a blob SHA the content can't be identified safely, so skip the cache
+        if not blob_sha:
+            return self._sync_get_file_content(download_url, blob_url)
+        
         # Check cache first
-        cache_key = f"file:{download_url}"
-        file_content = self._get_from_cache(cache_key)
+        file_content = _blob_cache.get(blob_sha)
         
-        if not file_content:
-            file_content = self._sync_get_file_content(download_url)
+        if file_content is None:
+            file_content = self._sync_get_file_content(download_url, blob_url)
             # Cache the file content
-            self._add_to_cache(cache_key, file_content)
+            if len(file_content) <= _blob_cache_max_file_size:
+                _blob_cache.set(blob_sha, file_content)
         
         return file_content
     
-    def _sync_get_file_content(self, download_url: str) -> bytes:
+    def _sync_get_file_content(self, download_url: str, blob_url: Optional[str] = None) -> bytes:
         """Download file content from GitHub (synchronous version)"""
-        response = self.session.get(download_url)
+        response = self._get(download_url)
+        if self._should_use_blob_api(response, blob_url):
+            response.close()
+            response = self._get(blob_url, headers=_RAW_BLOB_HEADERS)
+        
+        self._raise_for_download_error(response)
+        return response.content
+    
+    def _sync_download_to_spool(self, download_url: str, blob_url: Optional[str] = None) -> tempfile.SpooledTemporaryFile:
+        """
+        Download a large file into a spooled temporary file
         
+        The body is read in chunks, so only up to spool_max_size bytes of it are
+        held in memory; the rest goes to disk. The returned file is rewound.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
+        try:
+            with self._request_slots:
+                response = self._send(download_url, stream=True)
+                if self._should_use_blob_api(response, blob_url):
+                    response.close()
+                    response = self._send(blob_url, headers=_RAW_BLOB_HEADERS, stream=True)
+                
+                with response:
+                    self._raise_for_download_error(response)
+                    for chunk in response.iter_content(chunk_size=self.zip_chunk_size):
+                        spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+        
+        spool.seek(0)
+        return spool
+    
+    def _should_use_blob_api(self, response, blob_url: Optional[str]) -> bool:
+        """
+        Check whether a failed raw download should be retried through the Git blobs API
+        
+        Raw downloads don't count against the API rate limit, so they're tried first.
+        The blobs API is only used when the raw host fails for other reasons than
+        the credentials, such as a 404 for a path it can't resolve or a 5xx reply
+        that outlasted the retries.
+        """
+        if response.status_code == 200 or not blob_url:
+            return False
+        if response.status_code in (401, 403):
+            return False
+        
+        logger.warning(f"Raw download failed with {response.status_code}, fetching {blob_url} instead")
+        return True
+    
+    def _raise_for_download_error(self, response):
+        """Update the rate limit and raise a descriptive error for failed file downloads"""
         self._sync_update_rate_limit(response)
         
         if response.status_code == 401:
-            raise Exception("Authentication failed. Please provide a valid GitHub token.")
+            raise GitHubAuthError("Authentication failed. Please provide a valid GitHub token.")
         elif response.status_code == 403:
             if self.rate_limit_remaining == 0:
-                reset_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.rate_limit_reset))
-                raise Exception(f"GitHub API rate limit exceeded. Resets at {reset_time}")
-            raise Exception("API rate limit exceeded or insufficient permissions.")
+                raise self._rate_limit_error()
+            raise GitHubPermissionError("API rate limit exceeded or insufficient permissions.")
         elif response.status_code != 200:
-            raise Exception(f"Error downloading file: {response.status_code}")
-        
-        return response.content
+            raise GitHubAPIError(f"Error downloading file: {response.status_code}")
     
     def _sync_update_rate_limit(self, response):
         """Update rate limit information from response headers (synchronous version)"""
+        # Raw file downloads carry no rate limit headers, so most responses stop here
+        headers = response.headers
+        remaining = headers.get(_HDR_REMAINING)
+        if remaining is None:
+            return
+        
+        # Only the core budget is tracked; search, GraphQL and others are counted
+        # separately by GitHub and shouldn't throttle downloads
+        if headers.get(_HDR_RESOURCE, 'core') != 'core':
+            return
+        
         try:
-            self.rate_limit_remaining = int(response.headers.get('X-RateLimit-Remaining', self.rate_limit_remaining))
-            self.rate_limit_reset = int(response.headers.get('X-RateLimit-Reset', self.rate_limit_reset))
-        except (ValueError, TypeError):
-            pass  # Keep existing values if headers are missing or invalid
-    
-    def _add_to_cache(self, key: str, data: Any):
-        """Add data to the in-memory cache with timestamp"""
-        self._cache[key] = {
-            'timestamp': time.time(),
-            'data': data
-        }
+            remaining = int(remaining)
+            reset = int(headers[_HDR_RESET])
+        except (KeyError, ValueError, TypeError):
+            return  # Keep existing values if headers are invalid
+        
+        request = getattr(response, "request", None)
+        state = self._token_state.get(request.headers.get("Authorization")) if request is not None else None
+        if state is None or len(self._token_state) == 1:
+            self.rate_limit_remaining = remaining
+            self.rate_limit_reset = reset
+        else:
+            state["remaining"] = remaining
+            state["reset"] = reset
+            
+            # The pool only runs dry once every token has
+            states = self._token_state.values()
+            self.rate_limit_remaining = sum(item["remaining"] for item in states)
+            self.rate_limit_reset = min(item["reset"] for item in states)
+        
+        # Throttle concurrency while the budget is nearly spent; the limit is restored
+        # once a response shows the budget has been reset
+        limit = self.max_concurrent_requests
+        if self.rate_limit_remaining < self.rate_limit_low_watermark:
+            limit = max(1, limit * self.rate_limit_remaining // self.rate_limit_low_watermark)
+        if limit != self._budget_limit:
+            self._budget_limit = limit
+            self._apply_request_limit()
+    
+    def _add_to_cache(
+        self, key: str, data: Any, etag: Optional[str] = None, last_modified: Optional[str] = None, size: int = 0
+    ):
+        """Add data to the in-memory cache with timestamp, optional validators and its size in bytes"""
+        self._cache.set(key, _CacheEntry(data, etag, last_modified, size))
     
     def _get_from_cache(self, key: str) -> Optional[Any]:
         """Get data from cache if it exists and is not expired"""
-        if key in self._cache:
-            cache_item = self._cache[key]
-            if time.time() - cache_item['timestamp'] < self._cache_ttl:
-                return cache_item['data']
-            else:
-                # Remove expired item
-                del self._cache[key]
+        cache_item = self._cache.get(key)
+        if cache_item:
+            if time.monotonic() - cache_item.timestamp < self._cache_ttl:
+                return cache_item.data
+            elif not cache_item.revalidatable:
+                # Remove expired item; items with an ETag or Last-Modified are kept for revalidation
+                self._cache.pop(key, None)
         return None
     
+    def close(self):
+        """Close the HTTP session and its pooled connections"""
+        self.session.close()
+    
     def __del__(self):
         """Clean up resources when the object is destroyed"""
         # Close the session to release resources
         if hasattr(self, 'session'):
             self.session.close()
+
+
+@functools.lru_cache(maxsize=32)
+def get_github_api(token: Optional[str] = None) -> GitHubAPI:
+    """
+    Get a shared GitHubAPI instance for a token
+    
+    Reusing instances keeps their HTTP session and connection pool warm across
+    requests, so TLS handshakes are paid once per token instead of per download.
+    """
+    return GitHubAPI(token)
+
+def prune_shared_cache():
+    """
+    Remove old entries from the shared cache, at most once per cache TTL
+    
+    Expired entries are otherwise only dropped when read again. Entries with
+    an ETag or Last-Modified date are kept for revalidation until they are
+    twice the TTL old, since nearly every entry has one and memory would
+    otherwise only be bounded by the entry cap.
+    """
+    global _last_prune
+    ttl = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+    now = time.monotonic()
+    if now - _last_prune < ttl:
+        return
+    _last_prune = now
+    
+    for key, cache_item in _shared_cache.items():
+        age = now - cache_item.timestamp
+        if age >= 2 * ttl or (age >= ttl and not cache_item.revalidatable):
+            _shared_cache.pop(key, None)
+
+def close_github_apis():
+    """Close every live GitHubAPI instance and the shared pools, e.g. when the application shuts down"""
+    get_github_api.cache_clear()
+    for api in list(_open_apis):
+        api.close()
+    
+    # Shut the pools down and forget them, so they are recreated if the app starts again
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,98 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+_MISSING = object()
+
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU cache with optional entry, byte and age limits
+
+    Limits are enforced when entries are added, so the cache never grows past
+    its budget between cleanups. With max_bytes set, sizes are measured with
+    getsizeof (len by default) and values larger than the whole budget are
+    not stored at all.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        getsizeof: Callable[[Any], int] = len
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.getsizeof = getsizeof
+        self.current_bytes = 0
+
+        # key -> (stored_at, size, value), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value if it exists and has not expired"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+
+            stored_at, size, value = entry
+            if self.ttl is not None and time.monotonic() - stored_at >= self.ttl:
+                # Remove expired entry
+                self._remove(key)
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Add a value, evicting the least recently used entries beyond the limits"""
+        size = self.getsizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic(), size, value)
+            self.current_bytes += size
+
+            while self._over_limit():
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a value and return it"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Get a snapshot of the (key, value) pairs, oldest first, including expired ones"""
+        with self._lock:
+            return [(key, value) for key, (_, _, value) in self._entries.items()]
+
+    def clear(self):
+        """Remove all values"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _over_limit(self) -> bool:
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.current_bytes > self.max_bytes
+
+    def _remove(self, key: Hashable) -> Any:
+        _, size, value = self._entries.pop(key)
+        self.current_bytes -= size
+        return value
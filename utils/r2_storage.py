@@ -1,15 +1,114 @@
 import boto3
+import functools
 import os
 import io
 import logging
 import time
-from datetime import datetime, timedelta
-from botocore.exceptions import ClientError
-from typing import Optional, Tuple, List, Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.awsrequest import (
+    AWSHTTPConnection,
+    AWSHTTPSConnection,
+    AWSHTTPConnectionPool,
+    AWSHTTPSConnectionPool
+)
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from utils.memory_cache import MemoryCache
+from typing import Optional, Tuple, List, Dict, Iterable, Iterator
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Size of the writes file-like request bodies are sent in on R2 connections
+# with R2_TUNE_HTTP_BUFFER=1, instead of http.client's 8 KiB or urllib3 2's 16 KiB
+_HTTP_WRITE_BUFFER_SIZE = 1024 * 1024
+
+class _BufferedHTTPConnection(AWSHTTPConnection):
+    """R2 connection that sends file-like bodies in large writes"""
+    
+    def __init__(self, *args, **kwargs):
+        # urllib3 2 passes its own default in, so it's overridden rather than defaulted
+        kwargs['blocksize'] = _HTTP_WRITE_BUFFER_SIZE
+        super().__init__(*args, **kwargs)
+
+class _BufferedHTTPSConnection(AWSHTTPSConnection):
+    """R2 connection that sends file-like bodies in large writes"""
+    
+    def __init__(self, *args, **kwargs):
+        # urllib3 2 passes its own default in, so it's overridden rather than defaulted
+        kwargs['blocksize'] = _HTTP_WRITE_BUFFER_SIZE
+        super().__init__(*args, **kwargs)
+
+class _BufferedHTTPConnectionPool(AWSHTTPConnectionPool):
+    ConnectionCls = _BufferedHTTPConnection
+
+class _BufferedHTTPSConnectionPool(AWSHTTPSConnectionPool):
+    ConnectionCls = _BufferedHTTPSConnection
+
+def _use_large_write_buffer(client):
+    """
+    Make a client's connections send file-like bodies in 1 MiB writes
+    
+    Small writes cap upload throughput on fast links with one syscall per block,
+    while every connection buffers one block. botocore has no setting for this,
+    so the connection pools of this client's HTTP session are swapped instead;
+    other HTTP clients in the process are left alone.
+    """
+    pool_classes = {'http': _BufferedHTTPConnectionPool, 'https': _BufferedHTTPSConnectionPool}
+    
+    # These are private botocore and urllib3 attributes, so a release that moves
+    # them leaves the client on its default buffer instead of failing
+    http_session = getattr(getattr(client, '_endpoint', None), 'http_session', None)
+    manager = getattr(http_session, '_manager', None)
+    if not hasattr(http_session, '_pool_classes_by_scheme') or not hasattr(manager, 'pool_classes_by_scheme'):
+        logger.warning("Can't enlarge the R2 HTTP write buffer with this botocore version, keeping the default")
+        return
+    
+    http_session._pool_classes_by_scheme = pool_classes
+    manager.pool_classes_by_scheme = pool_classes
+
+@functools.lru_cache(maxsize=1)
+def _boto_config() -> Config:
+    """
+    Get the botocore config shared by the client and resource
+    
+    A connection pool with room for parallel multipart parts and delete batches,
+    adaptive retries for throttled calls and kept-alive connections. It's built on
+    first use, after main.py has loaded any .env file.
+    """
+    return Config(
+        max_pool_connections=int(os.getenv("R2_POOL_SIZE", "50")),
+        retries={'max_attempts': 5, 'mode': 'adaptive'},
+        tcp_keepalive=True,
+        signature_version='s3v4'
+    )
+
+@functools.lru_cache(maxsize=4)
+def _make_client(endpoint_url: str, access_key: str, secret_key: str, region: str):
+    """
+    Create an S3 client for R2, shared by every R2Storage with the same credentials
+    
+    Building a client loads botocore's service models, so it is only done once.
+    Clients are thread-safe, so one can serve every request.
+    """
+    client = boto3.client(
+        's3',
+        endpoint_url=endpoint_url,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name=region,
+        config=_boto_config()
+    )
+    
+    # Opt-in, since every connection then holds a 1 MiB buffer
+    if os.getenv("R2_TUNE_HTTP_BUFFER", "") == "1":
+        _use_large_write_buffer(client)
+    return client
+
 class R2Storage:
     def __init__(self):
         """Initialize Cloudflare R2 storage client"""
@@ -21,40 +120,63 @@ class R2Storage:
         self.public_url = os.getenv("R2_PUBLIC_URL")
         self.expiration_days = int(os.getenv("R2_EXPIRATION_DAYS", "7"))
         
+        # Part size used when streaming uploads (S3 requires at least 5 MiB per part)
+        self.multipart_chunk_size = 8 * 1024 * 1024
+        
+        # Parts of a streamed upload sent at the same time
+        self.upload_concurrency = int(os.getenv("R2_UPLOAD_CONCURRENCY", "4"))
+        
+        # Uploads of whole files are split into parts sent in parallel once they are large.
+        # Bigger parts mean fewer signed requests, but every thread buffers one part
+        self.transfer_config = TransferConfig(
+            multipart_threshold=int(os.getenv("R2_MULTIPART_THRESHOLD_MB", "16")) * 1024 * 1024,
+            multipart_chunksize=int(os.getenv("R2_MULTIPART_CHUNKSIZE_MB", "16")) * 1024 * 1024,
+            max_concurrency=int(os.getenv("R2_CONCURRENCY", "8")),
+            use_threads=True
+        )
+        
         # Link expiration settings
         self.link_expiration_hours = int(os.getenv("DOWNLOAD_LINK_EXPIRATION_HOURS", "24"))
         self.cleanup_days = int(os.getenv("R2_CLEANUP_DAYS", "30"))
         
-        # Check if required configuration is available
-        if not all([self.bucket_name, self.access_key, self.secret_key, self.endpoint_url]):
+        # Let a bucket lifecycle rule delete expired files instead of listing the bucket;
+        # opt-in since the rule replaces any lifecycle configuration the bucket has
+        self.lifecycle_cleanup = os.getenv("R2_LIFECYCLE_CLEANUP", "false").lower() == "true"
+        self._lifecycle_configured = False
+        
+        # Delete batches sent at the same time during cleanup
+        self.delete_concurrency = int(os.getenv("R2_DELETE_CONCURRENCY", "8"))
+        
+        # Check if required configuration is available; clients can be created with
+        # credentials alone, so that is checked once here instead of on every access
+        self._has_credentials = all([self.access_key, self.secret_key, self.endpoint_url])
+        if not (self.bucket_name and self._has_credentials):
             logger.warning("R2 storage configuration incomplete. Some features may not work.")
         
         self._client = None
         self._resource = None
+        
+        # Keys recently confirmed to exist, so repeated checks skip the HEAD request
+        self._existing_keys = MemoryCache(max_entries=1024, ttl=60)
     
     @property
     def client(self):
         """Lazy initialization of S3/R2 client"""
-        if not self._client and all([self.access_key, self.secret_key, self.endpoint_url]):
-            self._client = boto3.client(
-                's3',
-                endpoint_url=self.endpoint_url,
-                aws_access_key_id=self.access_key,
-                aws_secret_access_key=self.secret_key,
-                region_name=self.region
-            )
+        if self._client is None and self._has_credentials:
+            self._client = _make_client(self.endpoint_url, self.access_key, self.secret_key, self.region)
         return self._client
     
     @property
     def resource(self):
         """Lazy initialization of S3/R2 resource"""
-        if not self._resource and all([self.access_key, self.secret_key, self.endpoint_url]):
+        if self._resource is None and self._has_credentials:
             self._resource = boto3.resource(
                 's3',
                 endpoint_url=self.endpoint_url,
                 aws_access_key_id=self.access_key,
                 aws_secret_access_key=self.secret_key,
-                region_name=self.region
+                region_name=self.region,
+                config=_boto_config()
             )
         return self._resource
     
@@ -62,6 +184,8 @@ class R2Storage:
         """
         Upload a file to R2 storage
         
+        Large files are sent as a parallel multipart upload.
+        
         Args:
             file_data: The file data as BytesIO
             key: The storage key/path for the file
@@ -75,36 +199,177 @@ class R2Storage:
             return None
         
         try:
-            # Set expiration date for the object
-            expiration_date = datetime.now() + timedelta(days=self.expiration_days)
-            
-            # Add metadata for tracking and expiration
-            metadata = {
-                'created_at': datetime.now().isoformat(),
-                'expires_at': expiration_date.isoformat(),
-            }
+            expiration_date, metadata = self._object_expiry()
             
             # Upload the file
-            self.client.put_object(
-                Bucket=self.bucket_name,
-                Key=key,
-                Body=file_data,
-                ContentType=content_type,
-                Expires=expiration_date,
-                Metadata=metadata
+            self.client.upload_fileobj(
+                file_data,
+                self.bucket_name,
+                key,
+                ExtraArgs={
+                    'ContentType': content_type,
+                    'Expires': expiration_date,
+                    'Metadata': metadata
+                },
+                Config=self.transfer_config
             )
             
-            # Return the URL with a shorter expiration time for the actual link
-            if self.public_url:
-                return f"{self.public_url.rstrip('/')}/{key}"
-            else:
-                # Generate a presigned URL that expires sooner than the file itself
-                return self.generate_presigned_url(key)
+            return self._get_file_url(key)
                 
-        except ClientError as e:
+        except (ClientError, S3UploadFailedError) as e:
             logger.error(f"Error uploading file to R2: {str(e)}")
             return None
     
+    def upload_stream(self, chunks: Iterable[bytes], key: str, content_type: str = "application/zip") -> Optional[str]:
+        """
+        Upload a file to R2 storage from an iterable of byte chunks
+        
+        The chunks are sent as a multipart upload as they arrive, with up to
+        upload_concurrency parts in flight, so the whole file never needs to be
+        held in memory. Files smaller than one part are
+        sent with a single PUT instead.
+        
+        Args:
+            chunks: Iterable yielding the file data
+            key: The storage key/path for the file
+            content_type: The MIME type of the file
+            
+        Returns:
+            The URL of the uploaded file or None if upload failed
+        """
+        if not self.client:
+            logger.error("R2 client not initialized. Check your configuration.")
+            return None
+        
+        expiration_date, metadata = self._object_expiry()
+        
+        upload_id = None
+        parts = []
+        
+        try:
+            # Look one part ahead so a file that fits in one part can use a single PUT
+            part_iter = self._iter_parts(chunks)
+            part = next(part_iter, b"")
+            next_part = next(part_iter, None)
+            
+            if next_part is None:
+                # The whole file fits in one part, a single PUT is cheaper
+                self.client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    Body=part,
+                    ContentType=content_type,
+                    Expires=expiration_date,
+                    Metadata=metadata
+                )
+            else:
+                response = self.client.create_multipart_upload(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    ContentType=content_type,
+                    Expires=expiration_date,
+                    Metadata=metadata
+                )
+                upload_id = response['UploadId']
+                
+                # Send every part as soon as it is available, several at a time. Waiting
+                # for the oldest part keeps at most upload_concurrency parts in memory and
+                # collects the part records in order
+                in_flight = deque()
+                with ThreadPoolExecutor(max_workers=self.upload_concurrency) as executor:
+                    while part is not None:
+                        if len(in_flight) >= self.upload_concurrency:
+                            parts.append(in_flight.popleft().result())
+                        
+                        part_number = len(parts) + len(in_flight) + 1
+                        in_flight.append(executor.submit(self._upload_part, key, upload_id, part_number, part))
+                        part, next_part = next_part, next(part_iter, None)
+                    
+                    while in_flight:
+                        parts.append(in_flight.popleft().result())
+                
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+            
+            return self._get_file_url(key)
+            
+        except (ClientError, BotoCoreError) as e:
+            # Includes connection errors and timeouts, so an outage falls back to streaming
+            logger.error(f"Error uploading stream to R2: {str(e)}")
+            self._abort_multipart_upload(key, upload_id)
+            return None
+        except Exception:
+            # Errors from the chunk source are the caller's to handle
+            self._abort_multipart_upload(key, upload_id)
+            raise
+    
+    def _object_expiry(self) -> Tuple[datetime, Dict[str, str]]:
+        """Get the expiration date for a new object and the metadata that tracks it"""
+        now = datetime.now()
+        expiration_date = now + timedelta(days=self.expiration_days)
+        return expiration_date, {
+            'created_at': now.isoformat(),
+            'expires_at': expiration_date.isoformat(),
+        }
+    
+    def _iter_parts(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Regroup chunks into multipart-sized parts
+        
+        Chunks that already have the part size are passed through without being
+        copied, so producers should emit chunks of multipart_chunk_size bytes.
+        """
+        part_size = self.multipart_chunk_size
+        buffer = bytearray()
+        
+        for chunk in chunks:
+            if not buffer and len(chunk) == part_size:
+                yield chunk
+                continue
+                
+            buffer += chunk
+            while len(buffer) >= part_size:
+                yield bytes(buffer[:part_size])
+                del buffer[:part_size]
+        
+        # The last part may be smaller than the part size
+        if buffer:
+            yield bytes(buffer)
+    
+    def _upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> Dict:
+        """Upload a single part of a multipart upload and return its part record"""
+        response = self.client.upload_part(
+            Bucket=self.bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
+    
+    def _abort_multipart_upload(self, key: str, upload_id: Optional[str]):
+        """Abort an unfinished multipart upload so its parts don't linger in the bucket"""
+        if upload_id is None:
+            return
+            
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"Error aborting multipart upload for {key}: {str(e)}")
+    
+    def _get_file_url(self, key: str) -> Optional[str]:
+        """Get the URL clients should use to download an uploaded file"""
+        # Return the URL with a shorter expiration time for the actual link
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{key}"
+        else:
+            # Generate a presigned URL that expires sooner than the file itself
+            return self.generate_presigned_url(key)
+    
     def generate_presigned_url(self, key: str, expiration: int = None) -> Optional[str]:
         """
         Generate a presigned URL for accessing a private object
@@ -151,12 +416,34 @@ class R2Storage:
             
         try:
             self.client.delete_object(Bucket=self.bucket_name, Key=key)
+            self._existing_keys.pop(key)
             logger.info(f"Deleted file from R2: {key}")
             return True
         except ClientError as e:
             logger.error(f"Error deleting file from R2: {str(e)}")
             return False
     
+    def iter_expired_files(self, prefix: str = "github-zips/") -> Iterator[str]:
+        """
+        Yield the keys of files older than the cleanup age, one listing page at a time
+        
+        Args:
+            prefix: Only list objects with this prefix
+            
+        Raises:
+            ClientError: If a listing request fails
+        """
+        # Calculate cutoff date for expiration; LastModified is in UTC
+        cutoff_date = datetime.now(timezone.utc) - timedelta(days=self.cleanup_days)
+        
+        # List objects in the bucket with the given prefix
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', ()):
+                # Check if the object is older than our cutoff
+                if obj['LastModified'] < cutoff_date:
+                    yield obj['Key']
+    
     def list_expired_files(self, prefix: str = "github-zips/") -> List[str]:
         """
         List files that are older than the cleanup age and should be deleted
@@ -172,23 +459,7 @@ class R2Storage:
             return []
             
         try:
-            # Calculate cutoff date for expiration
-            cutoff_date = datetime.now() - timedelta(days=self.cleanup_days)
-            expired_keys = []
-            
-            # List objects in the bucket with the given prefix
-            paginator = self.client.get_paginator('list_objects_v2')
-            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
-                if 'Contents' not in page:
-                    continue
-                    
-                for obj in page['Contents']:
-                    # Check if the object is older than our cutoff
-                    if obj['LastModified'].replace(tzinfo=None) < cutoff_date:
-                        expired_keys.append(obj['Key'])
-            
-            return expired_keys
-            
+            return list(self.iter_expired_files(prefix))
         except ClientError as e:
             logger.error(f"Error listing expired files: {str(e)}")
             return []
@@ -197,18 +468,52 @@ class R2Storage:
         """
         Delete files that are older than the cleanup age
         
+        Expired keys are deleted in batches while the bucket is still being
+        listed, so only a few batches of keys are held in memory at a time.
+        
         Returns:
             A dictionary with the cleanup results
         """
         if not self.client:
             logger.warning("R2 client not initialized, cannot clean up expired files")
             return {"status": "error", "message": "R2 client not initialized"}
+        
+        if self.lifecycle_cleanup and self.configure_lifecycle():
+            return {
+                "status": "success",
+                "message": "Expired files are deleted by the bucket lifecycle rule",
+                "deleted_count": 0
+            }
             
         try:
-            # Get list of expired files
-            expired_keys = self.list_expired_files()
+            # Delete files in batches of 1000 (S3 limit for delete_objects), several
+            # batches at a time since each one is a slow round trip
+            batch_size = 1000
+            batch = []
+            expired_count = 0
+            deleted_count = 0
+            in_flight = deque()
             
-            if not expired_keys:
+            with ThreadPoolExecutor(max_workers=self.delete_concurrency) as executor:
+                for key in self.iter_expired_files():
+                    expired_count += 1
+                    batch.append(key)
+                    if len(batch) < batch_size:
+                        continue
+                    
+                    # Wait for the oldest batch so listing can't run far ahead of deleting
+                    if len(in_flight) >= self.delete_concurrency:
+                        deleted_count += in_flight.popleft().result()
+                    in_flight.append(executor.submit(self._delete_batch, batch))
+                    batch = []
+                
+                # The last batch may be smaller than the batch size
+                if batch:
+                    in_flight.append(executor.submit(self._delete_batch, batch))
+                while in_flight:
+                    deleted_count += in_flight.popleft().result()
+            
+            if not expired_count:
                 logger.info("No expired files to clean up")
                 return {
                     "status": "success", 
@@ -216,31 +521,11 @@ class R2Storage:
                     "deleted_count": 0
                 }
             
-            # Delete files in batches of 1000 (S3 limit for delete_objects)
-            batch_size = 1000
-            deleted_count = 0
-            
-            for i in range(0, len(expired_keys), batch_size):
-                batch = expired_keys[i:i+batch_size]
-                delete_dict = {
-                    'Objects': [{'Key': key} for key in batch],
-                    'Quiet': True
-                }
-                
-                self.client.delete_objects(
-                    Bucket=self.bucket_name,
-                    Delete=delete_dict
-                )
-                
-                deleted_count += len(batch)
-                logger.info(f"Deleted {len(batch)} expired files (batch {i//batch_size + 1})")
-            
             logger.info(f"Cleanup completed: deleted {deleted_count} expired files")
             return {
                 "status": "success",
                 "message": f"Cleanup completed successfully",
-                "deleted_count": deleted_count,
-                "deleted_files": expired_keys
+                "deleted_count": deleted_count
             }
             
         except ClientError as e:
@@ -248,6 +533,96 @@ class R2Storage:
             logger.error(error_message)
             return {"status": "error", "message": error_message}
     
+    def _delete_batch(self, keys: List[str]) -> int:
+        """Delete up to 1000 objects with one request and return how many were deleted"""
+        response = self.client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={
+                'Objects': [{'Key': key} for key in keys],
+                'Quiet': True
+            }
+        )
+        
+        # Quiet mode only reports the keys that failed
+        for key in keys:
+            self._existing_keys.pop(key)
+        errors = response.get('Errors', [])
+        if errors:
+            logger.error(f"Failed to delete {len(errors)} expired files, e.g. {errors[0].get('Key')}: {errors[0].get('Message')}")
+        
+        deleted = len(keys) - len(errors)
+        logger.info(f"Deleted {deleted} expired files")
+        return deleted
+    
+    def configure_lifecycle(self, prefix: str = "github-zips/") -> bool:
+        """
+        Set a bucket lifecycle rule that deletes files older than the cleanup age
+        and the parts of abandoned multipart uploads
+        
+        The rule is only sent once per instance. It replaces the bucket's whole
+        lifecycle configuration, and needs a token allowed to change bucket settings.
+        
+        Args:
+            prefix: Only expire objects with this prefix
+            
+        Returns:
+            True if the rule is in place, False otherwise
+        """
+        if self._lifecycle_configured:
+            return True
+        
+        try:
+            self.client.put_bucket_lifecycle_configuration(
+                Bucket=self.bucket_name,
+                LifecycleConfiguration={
+                    'Rules': [{
+                        'ID': 'expire-github-zips',
+                        'Status': 'Enabled',
+                        'Filter': {'Prefix': prefix},
+                        'Expiration': {'Days': self.cleanup_days},
+                        # Parts of uploads that were never completed or aborted, e.g. because
+                        # a serverless worker was stopped mid-upload, are also billed storage
+                        'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 1}
+                    }]
+                }
+            )
+            self._lifecycle_configured = True
+            logger.info(f"Configured lifecycle rule expiring {prefix} after {self.cleanup_days} days")
+            return True
+        except ClientError as e:
+            # Fall back to deleting expired files by listing the bucket
+            logger.error(f"Error configuring bucket lifecycle: {str(e)}")
+            return False
+    
+    def get_reusable_file(self, key: str, min_lifetime_hours: int) -> Optional[Tuple[str, int]]:
+        """
+        Get a link to a stored file that will outlive a new download link
+        
+        Args:
+            key: The storage key/path of the object
+            min_lifetime_hours: How long the file must still be kept before cleanup
+            
+        Returns:
+            Tuple of (download URL, size in bytes), or None if the file doesn't exist
+            or cleanup may delete it sooner
+        """
+        if not self.client:
+            return None
+        
+        try:
+            head = self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except (ClientError, BotoCoreError):
+            return None
+        
+        # Cleanup goes by age in UTC, the same way iter_expired_files and the lifecycle rule do
+        deleted_at = head['LastModified'] + timedelta(days=self.cleanup_days)
+        if deleted_at < datetime.now(timezone.utc) + timedelta(hours=min_lifetime_hours):
+            return None
+        
+        self._existing_keys.set(key, True)
+        url = self._get_file_url(key)
+        return (url, head['ContentLength']) if url else None
+    
     def check_file_exists(self, key: str) -> bool:
         """
         Check if a file exists in R2 storage
@@ -260,9 +635,13 @@ class R2Storage:
         """
         if not self.client:
             return False
+        
+        if self._existing_keys.get(key):
+            return True
             
         try:
             self.client.head_object(Bucket=self.bucket_name, Key=key)
+            self._existing_keys.set(key, True)
             return True
         except ClientError:
             return False
@@ -0,0 +1,115 @@
+import queue
+import threading
+import logging
+from typing import Callable, Iterator, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class ZipStreamCancelled(Exception):
+    """Raised inside the builder thread when the consumer stops reading the stream"""
+
+
+class _StreamWriter:
+    """Write-only, unseekable file object handed to the ZIP builder"""
+
+    def __init__(self, stream: "ZipStream"):
+        self._stream = stream
+
+    def write(self, data) -> int:
+        return self._stream._write(data)
+
+    def tell(self) -> int:
+        return self._stream.bytes_written
+
+    def flush(self):
+        pass
+
+
+class ZipStream:
+    """
+    Iterable over the bytes of an archive that is built on a background thread
+
+    The build function receives a write-only file object (suitable for
+    ``zipfile.ZipFile``) and everything it writes is handed to the consumer in
+    chunks of ``chunk_size`` bytes, so the full archive is never held in memory.
+    Written bytes are gathered in a single reused buffer, and ``bytes_written``
+    tracks the archive size. A stream can only be iterated once.
+    """
+
+    def __init__(self, build: Callable[[_StreamWriter], None], chunk_size: int = 64 * 1024, max_pending_bytes: int = 16 * 1024 * 1024):
+        self._build = build
+        self.chunk_size = chunk_size
+        self.bytes_written = 0
+
+        # Bounded queue so the builder can't run far ahead of a slow consumer
+        self._chunks = queue.Queue(maxsize=max(1, max_pending_bytes // chunk_size))
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._thread is not None:
+            raise RuntimeError("ZipStream can only be iterated once")
+
+        self._thread = threading.Thread(target=self._run_build, name="zip-stream", daemon=True)
+        self._thread.start()
+
+        try:
+            while True:
+                item = self._chunks.get()
+
+                # None marks the end of the archive
+                if item is None:
+                    break
+
+                # Re-raise errors from the builder thread in the consumer
+                if isinstance(item, BaseException):
+                    raise item
+
+                yield item
+        finally:
+            # Unblock the builder if the consumer stopped early
+            self._cancelled.set()
+
+    def _run_build(self):
+        """Run the build function and push the remaining bytes and end marker"""
+        try:
+            self._build(_StreamWriter(self))
+            if self._buffer:
+                self._put(bytes(self._buffer))
+                self._buffer.clear()
+            self._put(None)
+        except ZipStreamCancelled:
+            logger.info("ZIP stream consumer went away, stopped building archive")
+        except Exception as e:
+            # Hand the error to the consumer so it is raised where the stream is read
+            try:
+                self._put(e)
+            except ZipStreamCancelled:
+                pass
+
+    def _write(self, data) -> int:
+        """Buffer written bytes and hand out full chunks"""
+        size = len(data)
+        self.bytes_written += size
+        self._buffer += data
+
+        while len(self._buffer) >= self.chunk_size:
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            self._put(chunk)
+
+        return size
+
+    def _put(self, item):
+        """Put an item on the queue, giving up once the consumer has gone away"""
+        while not self._cancelled.is_set():
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise ZipStreamCancelled()
+